@@ -16,6 +16,12 @@ Default name for file with search queries -
              "return_date": "return_date_string"},
             {"another search task and so on"}, {}, {}, ...
             ]
+For very large task files use JSON Lines format instead (file name must end with '.jsonl') - one search
+query per line, without surrounding list:
+            {"departure": "California", "destination": "Texas", "date": "03/21/2018"}
+            {"departure": "LAX", "destination": "SFO", "date": "03/21/2018", "return_date": "03/25/2018"}
+Tasks are read, validated and expanded lazily(one by one), so the first search starts right away. Invalid
+queries are reported with their line numbers and skipped.
 
 So, what kind of search you can perform and what you will get as a result?
 For example, you can find all flights from Los Angeles to San Francisco that depart on 03/21/2018 just typing next:
@@ -40,6 +46,13 @@ flight and timestump, which represent file's creation time: -HHMMSS).
 Values keys speaks for themselves, didn't they? Well, only "price" key need a bit of explanation: this key shows
 lowest price for selected flight. Also, if you see "N/A" - that's probably mean you need to buy ticket directly
 at airport or searched class("basic economy", "main cabin" etc) not available for most of the flights.
+For round trips both legs are scraped in the same browser session and saved together into one file:
+    {"task": {"departure": "LAX", "destination": "SFO", "date": "03/21/2018", "return_date": "03/25/2018",
+              "trip_type": "round trip"},
+     "outbound": [flights from the first search page, same format as above],
+     "return": [flights from the second search page],
+     "timings": {"outbound": 14.2, "return": 9.8}}
+("timings" - seconds spent on loading and scraping each leg).
 WELL, WOW. But one more example: let's say - you wanna know list of all flight from all Alabama state airports
 to San Francisco? Not a problem - just type a state name instead of specific airport code.(Better to use
 parallel execution for this type of task):
@@ -48,10 +61,25 @@ And several .json files (one for each Alabama airport) will be saved into execut
 
 Here is some **help information**:
 
-    usage: aa_manager.py [-h] [-sp | -ss] {run,args} ...
+    usage: aa_manager.py [-h] [-sp | -ss] [--profile {time,cpu,mem}] [--archive ARCHIVE]
+                         {run,plan,worker,coordinate,reparse,topk,schedule,args} ...
     positional arguments:
-      {run,args}
+      {run,plan,worker,coordinate,reparse,topk,schedule,args}
         run            Execute search tasks from a file (default method - serial)
+        plan           Validate search tasks from a file and print expanded
+                       tasks, number of tasks per route and estimated runtime
+                       (browser is not started)
+        worker         Take search tasks from shared queue, execute them and
+                       push results back (with -sp - several workers)
+        coordinate     Put search tasks from a file to shared queue and report
+                       progress of workers
+        reparse        Parse all pages from raw results archive again (in
+                       parallel, on all cores)
+        topk           Find K cheapest flights for city/state search, skipping
+                       airport pairs which can't beat them(by historical prices)
+        schedule       Calculate refresh interval of every route/date from its
+                       price changes history and show routes due for refresh
+                       (or replay history with --simulate)
         args           Enter search parameters from command line and run
                        search(default execution method - serial)
 
@@ -60,6 +88,15 @@ Here is some **help information**:
       -sp, --parallel  Perform parallel search
       -ss, --serial    Perform search, using serial execution(tusks executed 'one-
                        by-one'). It's a default method.
+      --profile {time,cpu,mem}
+                       Profile search tasks of 'run' and 'args' commands and
+                       print merged report: 'time' - wall/CPU time of scraper
+                       methods (low overhead), 'cpu' - plus top
+                       functions(cProfile), 'mem' - plus top allocation
+                       sites(tracemalloc)
+      --archive ARCHIVE
+                       Directory of raw results archive - every scraped page is
+                       stored there compressed
 
 **run**:
 
@@ -68,6 +105,69 @@ Here is some **help information**:
                         File name (and full path, if needed) to the file with
                         search tasks
 
+**plan**:
+
+    usage: aa_manager.py plan [-h] [-f FILE_NAME]
+    -f FILE_NAME, --file FILE_NAME
+                        File name (and full path, if needed) to the file with
+                        search tasks
+
+'plan' is a 'dry run': Selenium and BeautifulSoup are imported only when a search really starts, so validating
+a task file takes milliseconds (check 'bench_startup.py' for startup-time benchmark):
+
+    aa_manager.py -sp plan -f search_tasks.jsonl
+
+**worker** and **coordinate**:
+
+    usage: aa_manager.py worker [-h] -q QUEUE [--lease-time LEASE_TIME] [--exit-when-done]
+    usage: aa_manager.py coordinate [-h] [-f FILE_NAME] -q QUEUE [--interval INTERVAL] [--no-wait]
+
+Multi-node execution: coordinator puts quantized tasks from a file into shared queue and reports progress,
+workers (any number of them, on any number of hosts) take tasks from the queue and push results(scraped data)
+back. Worker holds a lease on its task and extends it with heartbeats - if worker dies, its task returns
+to the queue after LEASE_TIME seconds. Queue is implemented in 'task_queue.py' (SQLite file):
+
+    aa_manager.py coordinate -f search_tasks.jsonl -q shared/queue.sqlite
+    aa_manager.py -sp worker -q shared/queue.sqlite
+
+**reparse**:
+
+    usage: aa_manager.py reparse [-h] [-o OUTPUT_DIR] archive_dir
+
+With '--archive' every scraped 'search results' page is stored compressed in content-addressed archive
+('results_archive.py'). 'reparse' runs parsing logic over all archived pages on all cores - new fields can be
+backfilled without scraping again. Flights of every page are saved to '<page hash>.json' (archive index tells which
+task and scrape time every page belongs to):
+
+    aa_manager.py --archive raw_pages -sp run -f search_tasks.jsonl
+    aa_manager.py reparse raw_pages -o reparsed
+
+**topk**:
+
+    usage: aa_manager.py topk [-h] [-k K] [--history HISTORY] [-o OUTPUT]
+                              departure_airport destination_airport departure_date [return_date]
+
+When you need only K cheapest flights of city/state search, 'topk' runs airport pairs concurrently and keeps K best
+fares found so far. Pairs are ordered by their historical lowest price(from result files in HISTORY directory) and
+pair is skipped, if its historical price can't beat K-th best fare (check 'top_k.py'). At the end merged
+top-K list and number of scraped/skipped pairs are printed:
+
+    aa_manager.py -sp topk California Texas 03/21/2018 -k 5 -o top5.json
+
+**schedule**:
+
+    usage: aa_manager.py schedule [-h] [--history HISTORY] --budget BUDGET [--simulate] [-o OUTPUT]
+
+Instead of scraping every route on the same interval, 'schedule' looks how often fares of every route/date changed
+in previous results (HISTORY directory) and gives volatile routes shorter refresh intervals, routes departing
+soon - a boost, and keeps all of them within BUDGET scrapes per hour (check 'refresh_scheduler.py'). Routes due for
+refresh can be saved as .jsonl task file for 'run'. With '--simulate' history is replayed to show how much
+scrape budget adaptive schedule saves compared with fixed interval, which catches the same part of fares changes:
+
+    aa_manager.py schedule --budget 20 -o due.jsonl
+    aa_manager.py -sp run -f due.jsonl
+    aa_manager.py schedule --budget 20 --simulate
+
 **args**:
 
     usage: aa_manager.py args [-h] departure_airport destination_airport departure_date [return_date]
@@ -83,17 +183,36 @@ Here is some **help information**:
                            round trips
 
 """
+import os
 import json
 import re
+import time
+import socket
 import datetime
 import argparse
+import functools
+import logging
+import threading
+from collections import Counter
 from multiprocessing import Pool
 
-from american_airlines import AmericanAirlines
+import profiling
+import task_queue
+import results_archive
+import price_history
+import top_k
+import refresh_scheduler
 
 AIRPORTS_CODES = "airports.json"  # this file contain all available for search airports codes
 NUM_PROCESSES = 4  # default number of processes for parallel execution
 SEARCH_TASKS = "search_tasks.json"  # default name for .json file with search queries
+# rough time(in seconds) single search takes, used by 'plan' command to estimate runtime
+ESTIMATED_TASK_TIME = {"one way": 45, "round trip": 60}
+WORKER_POLL_INTERVAL = 10  # seconds worker waits, when shared queue has no tasks for it
+COORDINATOR_INTERVAL = 30  # seconds between coordinator's progress reports
+
+logger = logging.getLogger("aa_manager")
+_ITEMS_SEPARATOR = re.compile(r'[\s,]*')  # whitespaces and commas between items of JSON array
 
 
 def get_airports_codes(airports_file):
@@ -113,6 +232,63 @@ def get_search_tasks(tasks_file):
         return json.load(file)
 
 
+def _iter_json_array(text):
+    """ Yields (line_number, item) for every item of JSON array stored in :param text: one by one.
+        Items decoded lazily, so line number of every search task is known without building whole list.
+        Items with broken JSON are reported and skipped (reading continues from the next '{').
+        Raises ValueError if :param text: is not a JSON array or has something after the closing ']'.
+    """
+    decoder = json.JSONDecoder()
+    position = len(text) - len(text.lstrip())
+    if not text.startswith('[', position):
+        raise ValueError("Tasks file must contain JSON array (list of search queries)")
+    position += 1
+    line_number = text.count('\n', 0, position) + 1
+    while True:
+        match = _ITEMS_SEPARATOR.match(text, position)
+        line_number += text.count('\n', position, match.end())
+        position = match.end()
+        if position >= len(text):
+            raise ValueError("Line {}: JSON array is not closed with ']'".format(line_number))
+        if text[position] == ']':
+            break
+        try:
+            item, end = decoder.raw_decode(text, position)
+        except json.JSONDecodeError as e:
+            logger.warning("Line %d: invalid JSON (%s), skipping", line_number, e.msg)
+            resume = max(e.pos, position + 1)
+            end = text.find('{', resume)
+            if end == -1:  # it was the last item - going to the closing ']'
+                end = max(text.rfind(']'), resume)
+        else:
+            yield line_number, item
+        line_number += text.count('\n', position, end)
+        position = end
+    if text[position + 1:].strip():
+        raise ValueError("Line {}: unexpected data after the end of JSON array".format(line_number))
+
+
+def iter_search_tasks(tasks_file):
+    """ Lazy version of 'get_search_tasks': yields (line_number, search_query) pairs one by one.
+        Two file formats are supported:
+            - .jsonl - one search query(JSON dictionary) per line (best choice for very large task files)
+            - .json  - list of search queries (check module docstring)
+        Search queries with broken JSON are reported(with line numbers) and skipped.
+    """
+    with open(tasks_file, 'r') as file:
+        if not tasks_file.lower().endswith('.jsonl'):
+            yield from _iter_json_array(file.read())
+            return
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError as e:
+                logger.warning("Line %d: invalid JSON (%s), skipping", line_number, e)
+
+
 def validate_airport_name(airports_list, airport_name):
     """ Here we compering entered airport name to names from AIRPORTS_CODES.
         Three types of names are permitted: airport code, city name(where airport located), state name.
@@ -180,85 +356,231 @@ def airports_codes_from_city(name, airports_list, airport_type):
     return temp
 
 
-def check_and_quantize_tasks(tasks_dictionaries, airports_list):
+def iter_quantized_tasks(numbered_tasks, airports_list):
     """
-        Here we perform 'quantization' of search queries to the form which can be
-        executed inside 'execute_single_crawler' function. Each task will be a list, that contains:
-        departure airport code, destination airport code, departure date, return date('None' for 'one way' trip),
-        trip type('one way' or 'round trip').
-        :param tasks_dictionaries: list of dictionaries (Our search queries).
+        Generator version of 'check_and_quantize_tasks': search queries are validated and 'quantized' one by one,
+        so executors can start the first search right away, without waiting for whole task file to be expanded.
+        Invalid search queries are reported(with line numbers) through 'logging' and skipped.
+        :param numbered_tasks: iterable of (line_number, dictionary) pairs (for example - 'iter_search_tasks' result)
         :param airports_list: return result from 'get_airports_codes' function
-        :return: list of lists.
+        :return: generator of lists(quantized tasks)
     """
-    tasks_list = []  # returns list of lists
-    for dictionary in tasks_dictionaries:
-        return_date = None
-        # validating 'departure' key
-        try:
-            departure_airport = dictionary['departure']
-            airport_type = validate_airport_name(airports_list, departure_airport)
-            if airport_type == "none":
-                print("Invalid airport name")
-                continue
-            departure_codes = airports_codes_from_city(departure_airport, airports_list, airport_type)
-        except (KeyError, ValueError) as e:
-            print(e.__str__())
-            continue  # skip this query dictionary if there is invalid data
-        # validating destination key
-        try:
-            destination_airport = dictionary['destination']
-            airport_type = validate_airport_name(airports_list, destination_airport)
-            if airport_type == "none":
-                print("Invalid airport name")
-                continue
-            destination_codes = airports_codes_from_city(destination_airport, airports_list, airport_type)
-        except (KeyError, ValueError) as e:
-            print(e.__str__())
-            continue
-        # validating 'date'
+    found = False
+    for line_number, dictionary in numbered_tasks:
         try:
+            # validating 'departure' and 'destination' keys
+            departure_codes = _airports_codes(dictionary['departure'], airports_list)
+            destination_codes = _airports_codes(dictionary['destination'], airports_list)
+            # validating 'date' (here we also checking 'return_date' if present)
             departure_date = dictionary['date']
-            check_dates(dictionary)  # here we also checking 'return_date' if present
-        except (KeyError, ValueError) as e:
-            print(e.__str__())
+            check_dates(dictionary)
+        except KeyError as e:
+            logger.warning("Line %d: missing key %s, skipping", line_number, e)
             continue
-        # validating "return_date" (we don't always need a return date)
-        try:
-            return_date = dictionary['return_date']
-        except KeyError:
-            pass
-        # forming tasks  (list of lists)
+        except (TypeError, ValueError) as e:
+            logger.warning("Line %d: %s, skipping", line_number, e)
+            continue
+        # we don't always need a return date
+        return_date = dictionary.get('return_date')
+        if return_date is None:
+            trip_type = "one way"
+        else:
+            trip_type = 'round trip'
+        # forming tasks
         for dep_airport in departure_codes:  # from each airport in departure list
             for dest_airport in destination_codes:  # to every single airport in destination list
-                if return_date is None:
-                    trip_type = "one way"
-                else:
-                    trip_type = 'round trip'
+                found = True
                 # that is actually our 'quantized' task
-                temp = [dep_airport, dest_airport, departure_date, return_date, trip_type]
-                tasks_list.append(temp)
+                yield [dep_airport, dest_airport, departure_date, return_date, trip_type]
     # if we cant identify even a single task - something wrong with input data
-    if not tasks_list:
+    if not found:
         raise ValueError('No tusks for execution found. Check input format!')
-    return tasks_list
 
 
-def execute_single_crawler(list_of_arguments):
-    """This function create and execute single instance of AmericanAirlines() class"""
-    crawler = AmericanAirlines(departure_airport=list_of_arguments[0], destination_airport=list_of_arguments[1],
-                               departure_date=list_of_arguments[2], return_date=list_of_arguments[3],
-                               trip_type=list_of_arguments[4])
-    crawler.run()
+def _airports_codes(airport_name, airports_list):
+    """ Validating airport name and returning list of airports codes for it (used by 'iter_quantized_tasks')"""
+    airport_type = validate_airport_name(airports_list, airport_name)
+    if airport_type == "none":
+        raise ValueError("Invalid airport name: '{}'".format(airport_name))
+    return airports_codes_from_city(airport_name, airports_list, airport_type)
 
 
-def serial_execution(tasks_list):
+def check_and_quantize_tasks(tasks_dictionaries, airports_list):
+    """
+        Here we perform 'quantization' of search queries to the form which can be
+        executed inside 'execute_single_crawler' function. Each task will be a list, that contains:
+        departure airport code, destination airport code, departure date, return date('None' for 'one way' trip),
+        trip type('one way' or 'round trip').
+        :param tasks_dictionaries: list of dictionaries (Our search queries).
+        :param airports_list: return result from 'get_airports_codes' function
+        :return: list of lists.
+    """
+    # position of the query inside the list used as its 'line number' in error reports
+    return list(iter_quantized_tasks(enumerate(tasks_dictionaries, start=1), airports_list))
+
+
+def execute_single_crawler(list_of_arguments, profile=None, archive=None):
+    """ This function create and execute single instance of AmericanAirlines() class.
+        :param profile: None or one of 'profiling.PROFILE_MODES' - in that case task executed under profiler
+        :param archive: None or path to raw results archive directory (check 'results_archive.py')
+        :return: name of the file with scraped data (or profiling results, when :param profile: is set)
+    """
+    # Selenium and BeautifulSoup are heavy to import - so we importing them only when we really need a browser
+    from american_airlines import AmericanAirlines
+
+    def create_crawler():
+        return AmericanAirlines(departure_airport=list_of_arguments[0], destination_airport=list_of_arguments[1],
+                                departure_date=list_of_arguments[2], return_date=list_of_arguments[3],
+                                trip_type=list_of_arguments[4],
+                                archive=None if archive is None else results_archive.ResultsArchive(archive))
+
+    if profile is not None:
+        label = "{}-{} {}".format(list_of_arguments[0], list_of_arguments[1], list_of_arguments[2])
+        return profiling.profile_task(create_crawler, profile, label)
+    return create_crawler().run()
+
+
+def serial_execution(tasks_list, profile=None, archive=None):
+    """ :return: merged 'profiling.ProfileReport' if :param profile: is set, otherwise - None"""
+    report = profiling.ProfileReport(profile) if profile else None
     for task in tasks_list:
-        execute_single_crawler(task)
+        result = execute_single_crawler(task, profile, archive)
+        if report is not None:
+            report.add(result)
+    return report
 
 
-def multiprocesses_execution(tasks_list):
+def multiprocesses_execution(tasks_list, profile=None, archive=None):
+    """ :param tasks_list: list or generator of quantized tasks - tasks are handed to workers as they come
+        :return: merged 'profiling.ProfileReport' if :param profile: is set, otherwise - None
+    """
+    report = profiling.ProfileReport(profile) if profile else None
     with Pool(processes=NUM_PROCESSES) as pool:
-        pool.map(execute_single_crawler, tasks_list)
+        for result in pool.imap_unordered(functools.partial(execute_single_crawler, profile=profile, archive=archive),
+                                          tasks_list):
+            if report is not None:
+                report.add(result)
+    return report
+
+
+def execute_queued_task(list_of_arguments, archive=None):
+    """ Executing task taken from shared queue. Returns result, which worker pushes back to the queue"""
+    file_name = execute_single_crawler(list_of_arguments, archive=archive)
+    with open(file_name, 'r') as file:
+        data = json.load(file)
+    return {"host": socket.gethostname(), "file": file_name, "data": data}
+
+
+def execute_for_flights(list_of_arguments, archive=None):
+    """ Executing single task and returning scraped flights('flights.Flight' records) - used by top-K search"""
+    file_name = execute_single_crawler(list_of_arguments, archive=archive)
+    return price_history.load_flights(file_name)
+
+
+def _send_heartbeats(queue, task_id, worker, stop):
+    """ Extending task lease until :param stop: event is set (runs in separate thread)"""
+    while not stop.wait(queue.lease_time / 3):
+        if not queue.heartbeat(task_id, worker):
+            logger.warning("Worker %s lost lease of task %s", worker, task_id)
+            return
+
+
+def worker_loop(queue, worker=None, execute=execute_queued_task, poll_interval=WORKER_POLL_INTERVAL,
+                exit_when_done=False):
+    """
+        Taking tasks from shared queue one by one, executing them and pushing results(or errors) back.
+        While task is running, its lease is extended by heartbeats - so if this worker dies, task returns to
+        the queue and will be executed by another worker.
+        :param queue: shared queue (check 'task_queue.py')
+        :param worker: unique worker name (default - host name and process id)
+        :param execute: function, which executes single task and returns its result
+        :param poll_interval: seconds to wait, when queue has no tasks for us
+        :param exit_when_done: return when all tasks in the queue are done(otherwise - wait for new tasks forever)
+        :return: number of tasks executed by this worker
+    """
+    if worker is None:
+        worker = "{}-{}".format(socket.gethostname(), os.getpid())
+    executed = 0
+    while True:
+        leased = queue.lease(worker)
+        if leased is None:
+            if exit_when_done and queue.is_finished():
+                return executed
+            time.sleep(poll_interval)
+            continue
+        task_id, task = leased
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_send_heartbeats, args=(queue, task_id, worker, stop), daemon=True)
+        heartbeat.start()
+        try:
+            result = execute(task)
+        except Exception as e:
+            logger.warning("Task %s %s failed: %r", task_id, task, e)
+            queue.fail(task_id, worker, repr(e))
+        else:
+            if not queue.complete(task_id, worker, result):
+                logger.warning("Task %s %s: lease expired, result discarded", task_id, task)
+        finally:
+            stop.set()
+            heartbeat.join()
+        executed += 1
+
+
+def multiprocesses_workers(queue, exit_when_done=False, execute=execute_queued_task):
+    """ Running NUM_PROCESSES workers(each in its own process) on the same queue"""
+    with Pool(processes=NUM_PROCESSES) as pool:
+        results = [pool.apply_async(worker_loop, (queue,), {"execute": execute, "exit_when_done": exit_when_done})
+                   for _ in range(NUM_PROCESSES)]
+        return sum(result.get() for result in results)
+
+
+def coordinate(queue, tasks_list, interval=COORDINATOR_INTERVAL, wait=True):
+    """
+        Putting tasks into shared queue and reporting progress until all of them are done or failed.
+        :param queue: shared queue (check 'task_queue.py')
+        :param tasks_list: list or generator of quantized tasks
+        :param interval: seconds between progress reports
+        :param wait: if False - just enqueue tasks and return
+        :return: dictionary with number of tasks in every status
+    """
+    print("Enqueued {} tasks".format(queue.enqueue(tasks_list)))
+    while True:
+        # workers, which stopped sending heartbeats, are considered dead - their tasks go back to the queue
+        requeued = queue.requeue_expired()
+        if requeued:
+            print("{} tasks of dead workers returned to the queue".format(requeued))
+        counts = queue.progress()
+        total = sum(counts.values())
+        print("Progress: {}/{} done, {} running, {} pending, {} failed".format(
+            counts[task_queue.DONE], total, counts[task_queue.LEASED], counts[task_queue.PENDING],
+            counts[task_queue.FAILED]))
+        if not wait or queue.is_finished():
+            return counts
+        time.sleep(interval)
+
+
+def plan_execution(tasks_list, execution_method):
+    """ Printing expanded tasks, number of tasks per route and estimated runtime (no browser is started).
+        :param tasks_list: list or generator of quantized tasks
+        :param execution_method: 'serial' or 'parallel'
+        :return: tuple - (Counter with number of tasks per route, estimated runtime in seconds)
+    """
+    routes = Counter()
+    total_time = 0
+    for task in tasks_list:
+        print("{} -> {}  {}  {}  ({})".format(task[0], task[1], task[2], task[3] or "", task[4]))
+        routes[(task[0], task[1])] += 1
+        total_time += ESTIMATED_TASK_TIME[task[4]]
+    if execution_method == 'parallel':
+        total_time /= NUM_PROCESSES
+    print("-" * 40)
+    print("Tasks per route:")
+    for (departure, destination), count in sorted(routes.items()):
+        print("  {} -> {}: {}".format(departure, destination, count))
+    print("Total tasks: {}".format(sum(routes.values())))
+    print("Estimated runtime ({} execution): {}".format(execution_method,
+                                                       datetime.timedelta(seconds=round(total_time))))
+    return routes, total_time
 
 
 if __name__ == "__main__":
@@ -284,17 +606,160 @@ if __name__ == "__main__":
                         dest='execution_method')
     # Serial execution will be default method, if parallel not mentioned explicitly
     parser.set_defaults(execution_method='serial')
+    # opt-in profiling of every search task(results of all tasks merged into single report)
+    parser.add_argument('--profile',
+                        help="Profile search tasks of 'run' and 'args' commands and print merged report: "
+                             "'time' - wall/CPU time of scraper methods (low overhead), 'cpu' - plus top "
+                             "functions(cProfile), 'mem' - plus top allocation sites(tracemalloc)",
+                        choices=profiling.PROFILE_MODES,
+                        default=None,
+                        action='store',
+                        dest='profile')
+    # storing raw 'search results' pages, so they can be parsed again later(check 'reparse' command)
+    parser.add_argument('--archive',
+                        help="Directory of raw results archive - every scraped page is stored there compressed",
+                        default=None,
+                        action='store',
+                        dest='archive')
     # creating 2 subparsers(run and args) with name 'subcommand' (parser.pars_args().subcommand - name of subparser)
     subparsers = parser.add_subparsers(dest="subcommand")
     # parser_a will get tasks list from a file
     parser_a = subparsers.add_parser('run', help="Execute search tasks from a file (default method - serial)")
     # command for loading tasks from file (default 'search_tasks.json')
     parser_a.add_argument('-f', '--file',
-                          help="File name (and full path, if needed) to the file with search tasks.",
+                          help="File name (and full path, if needed) to the file with search tasks "
+                               "(.json list or .jsonl - one task per line).",
                           default=SEARCH_TASKS,
                           action='store',
                           dest='file_name')
 
+    # parser_plan will show what tasks from a file would be executed(without running any search)
+    parser_plan = subparsers.add_parser('plan', help="Validate search tasks from a file and print expanded tasks, "
+                                                     "number of tasks per route and estimated runtime "
+                                                     "(browser is not started)")
+    parser_plan.add_argument('-f', '--file',
+                             help="File name (and full path, if needed) to the file with search tasks "
+                                  "(.json list or .jsonl - one task per line).",
+                             default=SEARCH_TASKS,
+                             action='store',
+                             dest='file_name')
+
+    # parser_worker takes tasks from shared queue (run it on every node)
+    parser_worker = subparsers.add_parser('worker', help="Take search tasks from shared queue, execute them and "
+                                                         "push results back (with -sp - several workers)")
+    parser_worker.add_argument('-q', '--queue',
+                               help="Path to shared queue(SQLite) file",
+                               required=True,
+                               action='store',
+                               dest='queue')
+    parser_worker.add_argument('--lease-time',
+                               help="Seconds, after which task of silent(dead) worker returns to the queue",
+                               type=float,
+                               default=task_queue.LEASE_TIME,
+                               action='store',
+                               dest='lease_time')
+    parser_worker.add_argument('--exit-when-done',
+                               help="Stop worker, when all tasks in the queue are done "
+                                    "(by default worker waits for new tasks)",
+                               action='store_true',
+                               dest='exit_when_done')
+
+    # parser_coordinate puts tasks from a file to shared queue and reports progress
+    parser_coordinate = subparsers.add_parser('coordinate', help="Put search tasks from a file to shared queue "
+                                                                 "and report progress of workers")
+    parser_coordinate.add_argument('-f', '--file',
+                                   help="File name (and full path, if needed) to the file with search tasks "
+                                        "(.json list or .jsonl - one task per line).",
+                                   default=SEARCH_TASKS,
+                                   action='store',
+                                   dest='file_name')
+    parser_coordinate.add_argument('-q', '--queue',
+                                   help="Path to shared queue(SQLite) file",
+                                   required=True,
+                                   action='store',
+                                   dest='queue')
+    parser_coordinate.add_argument('--interval',
+                                   help="Seconds between progress reports",
+                                   type=float,
+                                   default=COORDINATOR_INTERVAL,
+                                   action='store',
+                                   dest='interval')
+    parser_coordinate.add_argument('--no-wait',
+                                   help="Only enqueue tasks, don't wait for them to be done",
+                                   action='store_false',
+                                   dest='wait')
+
+    # parser_reparse runs 'parse_page' logic over archived pages(no scraping)
+    parser_reparse = subparsers.add_parser('reparse', help="Parse all pages from raw results archive again "
+                                                           "(in parallel, on all cores)")
+    parser_reparse.add_argument('archive_dir',
+                                help="Directory of raw results archive",
+                                action='store')
+    parser_reparse.add_argument('-o', '--output',
+                                help="Directory for parsed results - one <page hash>.json file per page",
+                                default="reparsed",
+                                action='store',
+                                dest='output_dir')
+
+    # parser_topk looks only for K cheapest flights of city/state search
+    parser_topk = subparsers.add_parser('topk', help="Find K cheapest flights for city/state search, skipping "
+                                                     "airport pairs which can't beat them(by historical prices)")
+    parser_topk.add_argument('departure_airport',
+                             help="Departure airport's code, city or state",
+                             action='store')
+    parser_topk.add_argument('destination_airport',
+                             help="Destination airport's code, city or state",
+                             action='store')
+    parser_topk.add_argument('departure_date',
+                             help="Departure date",
+                             action='store')
+    parser_topk.add_argument('return_date',
+                             help="Return date(optional). Enter this parameter only for round trips",
+                             nargs='?',
+                             action='store')
+    parser_topk.add_argument('-k',
+                             help="Number of cheapest flights to find (default - 10)",
+                             type=int,
+                             default=10,
+                             action='store',
+                             dest='k')
+    parser_topk.add_argument('--history',
+                             help="Directory with results of previous searches, used to estimate prices "
+                                  "(default - current directory)",
+                             default=".",
+                             action='store',
+                             dest='history')
+    parser_topk.add_argument('-o', '--output',
+                             help="Save top-K flights to this .json file",
+                             default=None,
+                             action='store',
+                             dest='output')
+
+    # parser_schedule decides which routes should be scraped again, spending scrape budget on volatile routes
+    parser_schedule = subparsers.add_parser('schedule', help="Calculate refresh interval of every route/date from "
+                                                             "its price changes history and show routes due for "
+                                                             "refresh (or replay history with --simulate)")
+    parser_schedule.add_argument('--history',
+                                 help="Directory with results of previous searches (default - current directory)",
+                                 default=".",
+                                 action='store',
+                                 dest='history')
+    parser_schedule.add_argument('--budget',
+                                 help="Maximum number of scrapes per hour for all routes together",
+                                 type=float,
+                                 required=True,
+                                 action='store',
+                                 dest='budget')
+    parser_schedule.add_argument('--simulate',
+                                 help="Replay history and compare adaptive schedule with fixed interval schedule",
+                                 action='store_true',
+                                 dest='simulate')
+    parser_schedule.add_argument('-o', '--output',
+                                 help="Save routes due for refresh as .jsonl search tasks file(for 'run' command)",
+                                 default=None,
+                                 action='store',
+                                 dest='output')
+
     # parser_b will accept search parameters from command line
     parser_b = subparsers.add_parser('args',
                                      help="Enter search parameters from command line "
@@ -325,14 +790,99 @@ if __name__ == "__main__":
 
     # getting our arguments
     args = parser.parse_args()
+    logging.basicConfig(format="%(levelname)s: %(message)s")
+    # profiling is done around every scraper run of 'run' and 'args' - other commands would silently ignore it
+    if args.profile is not None and args.subcommand not in ('run', 'args'):
+        parser.error("--profile can be used only with 'run' and 'args' commands")
     list_of_airports = get_airports_codes(AIRPORTS_CODES)
+    # 'dry run' - just validating and expanding tasks from a file
+    if args.subcommand == 'plan':
+        plan_execution(iter_quantized_tasks(iter_search_tasks(args.file_name), list_of_airports),
+                       args.execution_method)
+        parser.exit()
+    if args.subcommand == 'reparse':
+        try:
+            pages, parsed_flights = results_archive.reparse_archive(args.archive_dir, args.output_dir)
+        except ValueError as e:
+            parser.error(str(e))
+        print("Parsed {} pages ({} flights) into '{}'".format(pages, parsed_flights, args.output_dir))
+        parser.exit()
+    if args.subcommand == 'topk':
+        search_dict = [{'departure': args.departure_airport,
+                        'destination': args.destination_airport,
+                        'date': args.departure_date}]
+        if args.return_date is not None:
+            search_dict[0]['return_date'] = args.return_date
+        top_report = top_k.top_k_search(check_and_quantize_tasks(search_dict, list_of_airports), args.k,
+                                        functools.partial(execute_for_flights, archive=args.archive),
+                                        price_history.historical_lowest_prices(args.history),
+                                        NUM_PROCESSES if args.execution_method == 'parallel' else 1)
+        top_records = top_k.to_records(top_report)
+        for record in top_records:
+            print("{:>10}  {}-{}  {} -> {}  {}".format(record["price"], record["departure"], record["destination"],
+                                                       record["depart"], record["arrive"], record["stops"]))
+        print("Airport pairs: {total}, scraped: {scraped}, skipped: {skipped}, failed: {failed}".format(**top_report))
+        if args.output is not None:
+            with open(args.output, 'w') as file:
+                json.dump(top_records, file, indent=2)
+        parser.exit()
+    if args.subcommand == 'schedule':
+        if not os.path.isdir(args.history):
+            parser.error("History directory '{}' doesn't exist".format(args.history))
+        observations = refresh_scheduler.observations_from_history(args.history)
+        if args.simulate:
+            try:
+                simulation = refresh_scheduler.simulate(observations, args.budget)
+            except ValueError as e:
+                parser.error(str(e))
+            print("Fares changes replayed: {}".format(simulation["changes"]))
+            print("Adaptive schedule: {adaptive_scrapes} scrapes, recall {adaptive_recall:.1%}".format(**simulation))
+            print("Fixed interval ({fixed_interval:.2f} h): {fixed_scrapes} scrapes, "
+                  "recall {fixed_recall:.1%}".format(**simulation))
+            print("Scrape budget saved at equal recall: {saved:.1%}".format(**simulation))
+            parser.exit()
+        now = time.time()
+        histories = refresh_scheduler.build_histories(observations)
+        try:
+            intervals = refresh_scheduler.refresh_intervals(histories, args.budget, now)
+        except ValueError as e:
+            parser.error(str(e))
+        for key, interval in sorted(intervals.items(), key=lambda item: item[1]):
+            print("{}-{} {}{} ({}): every {:.2f} h".format(key[0], key[1], key[2],
+                                                        "" if key[3] is None else " - " + key[3], key[4], interval))
+        due = refresh_scheduler.due_routes(histories, intervals, now)
+        print("Scrapes per hour: {:.2f} (budget {}), routes due for refresh: {}".format(
+            sum(1 / interval for interval in intervals.values()), args.budget, len(due)))
+        if args.output is not None:
+            with open(args.output, 'w') as file:
+                for _, key in due:
+                    search_query = {"departure": key[0], "destination": key[1], "date": key[2]}
+                    if key[3] is not None:
+                        search_query["return_date"] = key[3]
+                    file.write(json.dumps(search_query) + "\n")
+        parser.exit()
+    # multi-node execution: coordinator fills shared queue, workers(on any number of hosts) execute tasks
+    if args.subcommand == 'coordinate':
+        coordinate(task_queue.SQLiteTaskQueue(args.queue),
+                   iter_quantized_tasks(iter_search_tasks(args.file_name), list_of_airports),
+                   args.interval, args.wait)
+        parser.exit()
+    if args.subcommand == 'worker':
+        shared_queue = task_queue.SQLiteTaskQueue(args.queue, lease_time=args.lease_time)
+        execute_task = functools.partial(execute_queued_task, archive=args.archive)
+        if args.execution_method == 'parallel':
+            executed_tasks = multiprocesses_workers(shared_queue, args.exit_when_done, execute_task)
+        else:
+            executed_tasks = worker_loop(shared_queue, execute=execute_task, exit_when_done=args.exit_when_done)
+        print("Worker executed {} tasks".format(executed_tasks))
+        parser.exit()
     # ok, here is block for 'file execution' logic
     if args.subcommand == 'run':
         print("Starting {} execution of search commands from file: '{}'".format(args.execution_method, args.file_name))
-        # Opening and loading file with search tasks
-        potential_tasks = get_search_tasks(args.file_name)
+        # Opening file with search tasks (tasks read, validated and formed lazily - one by one)
+        potential_tasks = iter_search_tasks(args.file_name)
         # Validating data and forming commands from search tasks:
-        list_of_tasks = check_and_quantize_tasks(potential_tasks, list_of_airports)
+        list_of_tasks = iter_quantized_tasks(potential_tasks, list_of_airports)
 
     # this is block for "command line" search arguments logic
     elif args.subcommand == 'args':
@@ -346,7 +896,9 @@ if __name__ == "__main__":
         list_of_tasks = check_and_quantize_tasks(search_dict, list_of_airports)
 
     if args.execution_method == 'serial':
-        serial_execution(list_of_tasks)
+        profile_report = serial_execution(list_of_tasks, args.profile, args.archive)
     elif args.execution_method == 'parallel':
-        multiprocesses_execution(list_of_tasks)
+        profile_report = multiprocesses_execution(list_of_tasks, args.profile, args.archive)
     print("All jobs done!")
+    if profile_report is not None:
+        print(profile_report.format())
@@ -20,7 +20,8 @@ from selenium.webdriver.firefox.firefox_binary import FirefoxBinary
 from selenium.common.exceptions import NoSuchElementException, ElementNotInteractableException
 from selenium.webdriver.common.keys import Keys
 
-from bs4 import BeautifulSoup
+import page_state
+from flights import iter_flights, dump_json
 
 
 class AmericanAirlines:
@@ -28,7 +29,7 @@ class AmericanAirlines:
     def __init__(self, departure_airport, destination_airport, departure_date, return_date=None,
                  sleeptime=3, trip_type="round trip",
                  airline="AA", price="lowest", passengers=1,
-                 passengers_type=None, daytime="all day", file_path="", file_format="json"):
+                 passengers_type=None, daytime="all day", file_path="", file_format="json", archive=None):
         """
 
         :param departure_airport: code of airport from which you ant to depart (3 characters string)
@@ -53,6 +54,8 @@ class AmericanAirlines:
                           - current directory)
         :param file_format: format in which data would be saved to a file. Chose from next option:
                                                                                                    -"json"
+        :param archive: 'results_archive.ResultsArchive' instance - if given, every parsed 'search results' page
+                        is stored there (so it can be parsed again later without scraping)
 
         """
 
@@ -78,6 +81,8 @@ class AmericanAirlines:
         self.return_date = return_date
         self.file_path = file_path
         self.file_format = file_format
+        self.archive = archive
+        self.leg_timings = {}  # time(in seconds) spent on loading and scraping of each leg: outbound/return
 
         self.driver = webdriver.Firefox(firefox_options=firefox_options)
         # site has bot protection and easy detect 'default cromedriver'so we using firefox for now
@@ -173,22 +178,27 @@ class AmericanAirlines:
         self.driver.find_element_by_xpath('//button[@id="flightSearchSubmitBtn"]').click()
         self._wait_to_load()
 
+    def detect_page_state(self):
+        """ Inspecting current page with a single script call (no reloads). Returns one of 'page_state.PAGE_STATES':
+            results, input error, bot wall, maintenance, empty results or unknown
+        """
+        return page_state.classify_page_state(self.driver.execute_script(page_state.PROBE_SCRIPT))
+
     def check_for_input_error(self):
-        """ Here we checking if error box appeared and if so - terminated execution"""
-        self.driver.refresh()
-        try:
-            self.driver.find_element_by_xpath('//div[@class="message-error margin-bottom"]')
+        """ Here we checking if error box(or bot wall, maintenance or unrecognized page) appeared and if so -
+            terminated execution.
+            :return: page state - 'page_state.RESULTS' or 'page_state.EMPTY_RESULTS'
+        """
+        state = self.detect_page_state()
+        if state == page_state.INPUT_ERROR:
             raise Exception("Search field was filled wrong")
-        except NoSuchElementException:
-            pass
-
-        try:
-            self.driver.find_element_by_xpath('//head/meta[@name="ROBOTS"]')
-            # text = self.driver.find_element_by_xpath('//body//div[@class="outerContainer"]/p[1]').text
-            # if text.strip() == "We're working on our site":
+        if state == page_state.BOT_WALL:
             raise Exception("Bot was detected!")
-        except NoSuchElementException:
-            pass
+        if state == page_state.MAINTENANCE:
+            raise Exception("Site is under maintenance")
+        if state == page_state.UNKNOWN:
+            raise Exception("Unrecognized page after search(neither results, nor 'no flights' message)")
+        return state
 
     def _wait_to_load(self):
         """ private method for waiting until 'loading' indicator gone"""
@@ -221,57 +231,28 @@ class AmericanAirlines:
         self.driver.find_element_by_xpath('//button[@data-triptype="roundTrip"]').click()
         self._wait_to_load()
 
-    def parse_page(self):
+    def get_page_source(self, leg="outbound"):
+        """ Getting html of current page (and storing it to the archive, if we have one)
+            :param leg: "outbound" or "return" - which page of the search results it is
+        """
+        page_source = self.driver.page_source
+        if self.archive is not None:
+            task = [self.departure, self.destination, self.departure_date, self.return_date, self.trip_type]
+            self.archive.put(page_source, task, leg)
+        return page_source
+
+    def iter_parse_page(self, page_source=None):
+        """ Generator variant of 'parse_page': yields flights from 'search results' page one by one
+            as compact 'flights.Flight' records (check 'flights.py' for fields description)
+            :param page_source: html of the page (default - current page of the browser)
+        """
+        if page_source is None:
+            page_source = self.driver.page_source
+        return iter_flights(page_source)
+
+    def parse_page(self, page_source=None):
         """Here we scraping flights information from 'search results' page"""
-        flights_list = []
-        bs = BeautifulSoup(self.driver.page_source, "html.parser")
-        # getting all flight available
-        flights_block = bs.select("li.flight-search-results.js-moreflights")
-        for flight in flights_block:
-            # getting departure and arrival time
-            departure_time = flight['data-departuretime']
-            arrival_time = flight['data-arrivaltime']
-            # getting information about amount of stops
-            try:
-                stops = flight.select_one("div.span3 div.flight-duration-stops a.text-underline").get_text()
-                stops = stops.strip()
-                temp = stops.split("\n")
-                stops = temp[0]
-            except AttributeError:
-                stops = "Nonstop"
-
-            # getting flight number and airplane model
-            flight_numbers_models = []
-            flight_numbers = flight.select("span.flight-numbers")
-            plane_model = flight.select("span.wrapText")
-            for number, name in zip(flight_numbers, plane_model):
-                temp = {"number": (number.get_text()).strip(),
-                        "airplane": (name.get_text()).strip(),
-                        }
-                flight_numbers_models.append(temp)
-
-            # getting lowest price
-            lowest_price = flight['data-tripprice']
-            # for the case, when we need to book ticket directly at airport
-            if lowest_price == "9999999999":
-                lowest_price = "N/A"
-            # dictionary with information about single flight
-            flight_info = {"depart": departure_time,
-                           "arrive": arrival_time,
-                           "stops": stops,
-                           "price": lowest_price,
-                           "details": flight_numbers_models
-                           }
-            flights_list.append(flight_info)
-            # # print debugging info
-            # print("Depart at: {}     Arrive at: {}".format(departure_time, arrival_time))
-            # print("Stops: {}".format(stops))
-            # print("Lowest price: ${}".format(lowest_price))
-            # print("Flight details:")
-            # for plane in flight_numbers_models:
-            #     print(plane)
-            # print("-"*80)
-        return flights_list
+        return [flight.to_dict() for flight in self.iter_parse_page(page_source)]
 
     @staticmethod
     def _generate_file_name(departure, destination, date, file_format):
@@ -286,13 +267,38 @@ class AmericanAirlines:
         return departure + "_" + destination + year + "-" + month + "-" + day + "-" + time_string + "." + file_format
 
     def save_to_json(self, filename, list_of_dict):
-        """ Method to save scraped data to .json file
+        """ Method to save scraped data to .json file. Records are written one by one, so any iterable
+            (for example - generator from ::method::**iter_parse_page**) can be streamed to the file.
+            Output is the same as json.dump(list, file, indent=2) would produce.
             :param filename: unique file name generated by ::method::**_generate_file_name**
-            :param list_of_dict: scraped data, returned by ::method::**parse_page**
+            :param list_of_dict: scraped data, returned by ::method::**parse_page** (or Flight records)
         """
         name = os.path.join(self.file_path, filename)
         with open(name, 'w') as file:
-            json.dump(list_of_dict, file, indent=2)
+            dump_json(list_of_dict, file)
+
+    def save_round_trip(self, filename, outbound_flights, return_flights):
+        """ Method to save both legs of round trip into one .json record:
+                {"task": {"departure": ..., "destination": ..., "date": ..., "return_date": ...,
+                          "trip_type": "round trip"},
+                 "outbound": [flights from the 1st search page],
+                 "return": [flights from the 2nd search page],
+                 "timings": {"outbound": seconds, "return": seconds}}
+            :param filename: unique file name generated by ::method::**_generate_file_name**
+            :param outbound_flights: scraped outbound flights, returned by ::method::**parse_page**
+            :param return_flights: scraped return flights, returned by ::method::**parse_page**
+        """
+        record = {"task": {"departure": self.departure,
+                           "destination": self.destination,
+                           "date": self.departure_date,
+                           "return_date": self.return_date,
+                           "trip_type": self.trip_type},
+                  "outbound": outbound_flights,
+                  "return": return_flights,
+                  "timings": self.leg_timings}
+        name = os.path.join(self.file_path, filename)
+        with open(name, 'w') as file:
+            json.dump(record, file, indent=2)
 
     # def _get_my_ip(self):
     #     self.driver.get('https://checkmyip.com/')
@@ -300,7 +306,9 @@ class AmericanAirlines:
     #     print("My current ip was: {}".format(my_ip))
 
     def run(self):
-        """Here we executing scraping logic"""
+        """ Here we executing scraping logic.
+            :return: name of the file with scraped data
+        """
         if not self._validate_file_format():
             raise ValueError("Unsupported file format for saving data!")
         self.press_accept_cookies()
@@ -335,25 +343,47 @@ class AmericanAirlines:
         self.fill_destination_form()
 
         # all search fields filled, and we beginning the search:
+        leg_start = time.time()
         self.click_search()
-        self.check_for_input_error()
         self.fully_load_results()
+        state = self.check_for_input_error()
 
         # scraping data from search results:
-        if self._one_way_trip():
-            list_results = self.parse_page()
-            file_name = self._generate_file_name(self.departure, self.destination, self.departure_date, self.file_format)
-            self.save_to_json(file_name, list_results)
-        # for round trip we need to scrap 2nd search page with returning flights
-        if self._round_trip():
+        file_name = self._generate_file_name(self.departure, self.destination, self.departure_date, self.file_format)
+        if state == page_state.EMPTY_RESULTS:
+            # no flights found - nothing to parse (and no second page for round trip)
+            if self.archive is not None:
+                self.get_page_source()
+            self.leg_timings['outbound'] = round(time.time() - leg_start, 3)
+            if self._round_trip():
+                self.save_round_trip(file_name, [], [])
+            else:
+                self.save_to_json(file_name, [])
+        elif self._one_way_trip():
+            self.save_to_json(file_name, self.iter_parse_page(self.get_page_source()))
+            self.leg_timings['outbound'] = round(time.time() - leg_start, 3)
+        # for round trip we scraping both pages: outbound flights first and then 2nd page with returning flights
+        elif self._round_trip():
+            outbound_flights = self.parse_page(self.get_page_source())
+            self.leg_timings['outbound'] = round(time.time() - leg_start, 3)
+            leg_start = time.time()
             self.click_on_round_trip()
             self.fully_load_results()
-            list_results2 = self.parse_page()
-            file_name = self._generate_file_name(self.departure, self.destination, self.departure_date, self.file_format)
-            self.save_to_json(file_name, list_results2)
+            # second page can be a bot wall(or maintenance, unknown page) too - it must fail, not be saved as empty
+            if self.check_for_input_error() == page_state.EMPTY_RESULTS:
+                if self.archive is not None:
+                    self.get_page_source("return")
+                return_flights = []
+            else:
+                return_flights = self.parse_page(self.get_page_source("return"))
+            self.leg_timings['return'] = round(time.time() - leg_start, 3)
+            self.save_round_trip(file_name, outbound_flights, return_flights)
             time.sleep(0.5)
-
+        print("{}-{} {}: {}".format(self.departure, self.destination, self.trip_type,
+                                    ", ".join("{} leg {:.1f} sec".format(leg, seconds)
+                                              for leg, seconds in self.leg_timings.items())))
         # self._get_my_ip()
+        return file_name
 
 
 if __name__ == "__main__":
@@ -0,0 +1,53 @@
+"""
+Startup-time benchmark for 'aa_manager.py'.
+Measures (in fresh interpreters) how long it takes to import 'aa_manager' and to run 'plan' command
+on a generated task file, and checks that heavy modules (Selenium, BeautifulSoup) were not imported.
+Usage:
+    python bench_startup.py [number_of_runs]
+"""
+import os
+import sys
+import json
+import time
+import datetime
+import tempfile
+import subprocess
+
+HEAVY_MODULES = ("selenium", "bs4")
+IMPORT_CHECK = "import sys, aa_manager; print(','.join(m for m in {} if m in sys.modules))".format(HEAVY_MODULES)
+
+
+def measure(command, runs):
+    """ Running :param command: :param runs: times, returns (best, median) wall time in milliseconds"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[0], timings[len(timings) // 2]
+
+
+def main(runs=10):
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(project_dir)
+    date = (datetime.date.today() + datetime.timedelta(days=30)).strftime("%m/%d/%Y")
+    with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as file:
+        file.write(json.dumps({"departure": "California", "destination": "Texas", "date": date}) + "\n")
+        tasks_file = file.name
+    try:
+        loaded = subprocess.run([sys.executable, "-c", IMPORT_CHECK], check=True,
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+        print("Heavy modules imported by 'import aa_manager': {}".format(loaded or "none"))
+        benchmarks = [("python (empty interpreter)", [sys.executable, "-c", "pass"]),
+                      ("import aa_manager", [sys.executable, "-c", "import aa_manager"]),
+                      ("aa_manager.py plan", [sys.executable, "aa_manager.py", "plan", "-f", tasks_file])]
+        for name, command in benchmarks:
+            best, median = measure(command, runs)
+            print("{:<30} best: {:8.1f} ms   median: {:8.1f} ms".format(name, best, median))
+    finally:
+        os.remove(tasks_file)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,144 @@
+"""
+Compact records for scraped flights and helpers for parsing them from 'search results' page.
+
+Each flight is a 'Flight' named tuple (no per-instance __dict__, so millions of them are cheap to keep around)
+with typed fields:
+    depart, arrive - datetime.datetime (None if site returned something we cant parse)
+    stops          - number of stops (int, 0 for "Nonstop")
+    price          - lowest price as decimal.Decimal (None when price is "N/A")
+    legs           - tuple of 'Leg' named tuples (flight number and airplane model)
+    depart_text, arrive_text, stops_text, price_text - the same values exactly as they were shown on the site
+Use 'Flight.to_dict()' to get the same dictionary, that was always saved to .json files (it's built from *_text
+fields, so values, which we cant parse, are saved unchanged):
+    {"depart": "03-21-2018 21:20:00", "arrive": "03-21-2018 22:54:00", "stops": "Nonstop", "price": "46.00",
+     "details": [{"number": "AA  6039", "airplane": "E75-Embraer RJ-175"}]}
+"""
+import re
+import json
+import textwrap
+import datetime
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+DATETIME_FORMAT = "%m-%d-%Y %H:%M:%S"  # format of 'data-departuretime' and 'data-arrivaltime' attributes
+NO_PRICE = "9999999999"  # site uses this value when ticket can be bought only at airport
+NOT_AVAILABLE = "N/A"
+
+
+def parse_datetime(value):
+    """Transforming site's date-time string (mm-dd-yyyy HH:MM:SS) to datetime.datetime. Returns None on failure"""
+    try:
+        return datetime.datetime.strptime(value.strip(), DATETIME_FORMAT)
+    except (ValueError, AttributeError):
+        return None
+
+
+def parse_price(value):
+    """Transforming price string to decimal.Decimal. "N/A" (and site's 9999999999) becomes None"""
+    if value is None:
+        return None
+    value = value.strip().replace(",", "").lstrip("$")
+    if value in (NO_PRICE, NOT_AVAILABLE, ""):
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        return None
+
+
+def parse_stops(stops_text):
+    """ Getting number of stops from stops string: "Nonstop" -> 0, "1 stop" -> 1, "2 stops" -> 2.
+        If we cant find any number in the string - flight considered to be nonstop.
+    """
+    match = re.search(r'(\d+)\s*stop', stops_text, re.IGNORECASE)
+    if match:
+        return int(match.group(1))
+    return 0
+
+
+class Leg(namedtuple('Leg', ['number', 'airplane'])):
+    """Single flight segment: flight number ("AA  6039") and airplane model ("E75-Embraer RJ-175")"""
+    __slots__ = ()
+
+    def to_dict(self):
+        return {"number": self.number, "airplane": self.airplane}
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        return cls(number=dictionary['number'], airplane=dictionary['airplane'])
+
+
+class Flight(namedtuple('Flight', ['depart', 'arrive', 'stops', 'price', 'legs',
+                                   'depart_text', 'arrive_text', 'stops_text', 'price_text'])):
+    """Single flight from 'search results' page. Check module docstring for fields description"""
+    __slots__ = ()
+
+    @classmethod
+    def from_strings(cls, depart, arrive, stops, price, legs):
+        """ Creating Flight from strings, shown on the site: typed fields parsed, original strings kept as they are"""
+        if price == NO_PRICE:
+            price = NOT_AVAILABLE
+        return cls(depart=parse_datetime(depart), arrive=parse_datetime(arrive), stops=parse_stops(stops),
+                   price=parse_price(price), legs=tuple(legs),
+                   depart_text=depart, arrive_text=arrive, stops_text=stops, price_text=price)
+
+    def to_dict(self):
+        """ Returns dictionary in the old 'parse_page' format (the one we saving to .json files)"""
+        return {"depart": self.depart_text,
+                "arrive": self.arrive_text,
+                "stops": self.stops_text,
+                "price": self.price_text,
+                "details": [leg.to_dict() for leg in self.legs]
+                }
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        """ Creating Flight from dictionary, saved by previous scraper runs"""
+        return cls.from_strings(dictionary['depart'], dictionary['arrive'], dictionary['stops'], dictionary['price'],
+                                (Leg.from_dict(leg) for leg in dictionary.get('details', [])))
+
+
+def to_serializable(record):
+    """ Returns JSON friendly form of a record: Flight(or Leg) becomes dictionary, everything else stays as it is"""
+    if isinstance(record, (Flight, Leg)):
+        return record.to_dict()
+    return record
+
+
+def iter_flights(page_source):
+    """ Generator, which yields Flight records from 'search results' page one by one.
+        :param page_source: html of 'search results' page (webdriver.page_source)
+    """
+    # bs4 only needed for parsing, so we importing it here - it keeps this module light for other scripts
+    from bs4 import BeautifulSoup
+
+    bs = BeautifulSoup(page_source, "html.parser")
+    # getting all flight available
+    for flight in bs.select("li.flight-search-results.js-moreflights"):
+        # getting information about amount of stops
+        try:
+            stops = flight.select_one("div.span3 div.flight-duration-stops a.text-underline").get_text()
+            stops = stops.strip().split("\n")[0]
+        except AttributeError:
+            stops = "Nonstop"
+        # getting flight number and airplane model
+        flight_numbers = flight.select("span.flight-numbers")
+        plane_model = flight.select("span.wrapText")
+        legs = tuple(Leg(number=(number.get_text()).strip(), airplane=(name.get_text()).strip())
+                     for number, name in zip(flight_numbers, plane_model))
+        yield Flight.from_strings(flight['data-departuretime'], flight['data-arrivaltime'], stops,
+                                  flight['data-tripprice'], legs)
+
+
+def dump_json(records, file):
+    """ Streaming replacement for json.dump(list, file, indent=2): records(dictionaries or Flight records)
+        written to the file one by one, so generator results never have to be collected into a list.
+        Output is exactly the same as json.dump would produce for a list.
+    """
+    first = True
+    for record in records:
+        file.write("[\n" if first else ",\n")
+        first = False
+        text = json.dumps(to_serializable(record), indent=2)
+        file.write(textwrap.indent(text, "  ", lambda line: True))
+    file.write("[]" if first else "\n]")
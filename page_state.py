@@ -0,0 +1,73 @@
+"""
+Detecting state of the page we got after search: results, input error, bot wall, maintenance or empty results.
+Every state has its own marker on the page - page without any of them (search form wasn't submitted, results are
+still loading, site changed its markup etc.) is 'unknown', so it never gets saved as empty results.
+
+In the browser page is inspected once - with a single script call ('PROBE_SCRIPT'), which returns 'probe'
+dictionary. The same probe can be built from saved html with 'probe_page_source()' (for archived pages and tests).
+'classify_page_state()' turns probe into one of the states below.
+"""
+RESULTS = "results"
+INPUT_ERROR = "input error"
+BOT_WALL = "bot wall"
+MAINTENANCE = "maintenance"
+EMPTY_RESULTS = "empty results"
+UNKNOWN = "unknown"
+PAGE_STATES = (RESULTS, INPUT_ERROR, BOT_WALL, MAINTENANCE, EMPTY_RESULTS, UNKNOWN)
+
+# selectors are the same as in old xpath checks: error box, ROBOTS meta tag and flights list
+INPUT_ERROR_SELECTOR = 'div[class="message-error margin-bottom"]'
+ROBOTS_SELECTOR = 'head meta[name="ROBOTS"]'
+MAINTENANCE_SELECTOR = 'div.outerContainer > p'
+MAINTENANCE_TEXT = "We're working on our site"
+FLIGHTS_SELECTOR = "li.flight-search-results.js-moreflights"
+NO_FLIGHTS_TEXT = "couldn't find any flights"  # message on 'search results' page without flights
+
+
+def _normalize_text(text):
+    """ Lowercase text with typographic apostrophes replaced by plain ones (site uses both)"""
+    return text.replace("\u2019", "'").lower()
+
+
+PROBE_SCRIPT = """
+var maintenance = document.querySelector('{maintenance}');
+var text = document.body === null ? '' : document.body.textContent;
+return {{
+    inputError: document.querySelector('{input_error}') !== null,
+    robotsMeta: document.querySelector('{robots}') !== null,
+    maintenanceText: maintenance === null ? '' : maintenance.textContent,
+    flights: document.querySelectorAll('{flights}').length,
+    noFlights: text.replace(/\\u2019/g, "'").toLowerCase().indexOf("{no_flights}") !== -1
+}};
+""".format(maintenance=MAINTENANCE_SELECTOR, input_error=INPUT_ERROR_SELECTOR, robots=ROBOTS_SELECTOR,
+           flights=FLIGHTS_SELECTOR, no_flights=NO_FLIGHTS_TEXT)
+
+
+def probe_page_source(page_source):
+    """ Building the same probe, as 'PROBE_SCRIPT' returns in the browser, from html string"""
+    # bs4 only needed for saved pages - browser runs PROBE_SCRIPT itself
+    from bs4 import BeautifulSoup
+
+    bs = BeautifulSoup(page_source, "html.parser")
+    maintenance = bs.select_one(MAINTENANCE_SELECTOR)
+    return {"inputError": bs.select_one(INPUT_ERROR_SELECTOR) is not None,
+            "robotsMeta": bs.select_one(ROBOTS_SELECTOR) is not None,
+            "maintenanceText": "" if maintenance is None else maintenance.get_text(),
+            "flights": len(bs.select(FLIGHTS_SELECTOR)),
+            "noFlights": bs.body is not None and NO_FLIGHTS_TEXT in _normalize_text(bs.body.get_text())}
+
+
+def classify_page_state(probe):
+    """ Returns one of PAGE_STATES for :param probe: (result of PROBE_SCRIPT or 'probe_page_source')"""
+    if probe["inputError"]:
+        return INPUT_ERROR
+    # maintenance page has ROBOTS meta tag too, so we checking its text first
+    if MAINTENANCE_TEXT.lower() in _normalize_text(probe["maintenanceText"]):
+        return MAINTENANCE
+    if probe["robotsMeta"]:
+        return BOT_WALL
+    if probe["flights"]:
+        return RESULTS
+    if probe["noFlights"]:
+        return EMPTY_RESULTS
+    return UNKNOWN
@@ -0,0 +1,92 @@
+"""
+Reading results of previous scraper runs (.json files saved by AmericanAirlines) as price history.
+
+Result files are recognized by their generated names: 'LAX_SFO2018-03-21-220649.json' - departure airport code,
+destination airport code, departure date and creation time(HHMMSS). Full scrape time is taken from file
+modification time. Both formats are supported: list of flights(one way) and round trip record
+({"task": ..., "outbound": [...], "return": [...]}).
+"""
+import os
+import re
+import json
+import datetime
+from collections import namedtuple
+
+from flights import Flight
+
+RESULT_FILE_NAME = re.compile(r'^([A-Za-z0-9]{3})_([A-Za-z0-9]{3})(\d{4})-(\d{2})-(\d{2})-(\d{6})\.json$')
+
+ResultFile = namedtuple('ResultFile', ['departure', 'destination', 'date', 'scraped_at', 'path'])
+
+
+def iter_result_files(directory):
+    """ Generator of 'ResultFile' records (route, departure date(mm/dd/yyyy), scrape time, path) for every
+        result file in :param directory: (other files, and files with impossible dates in the name, are ignored)
+    """
+    for name in os.listdir(directory):
+        match = RESULT_FILE_NAME.match(name)
+        if match is None:
+            continue
+        departure, destination, year, month, day, _ = match.groups()
+        try:
+            datetime.date(int(year), int(month), int(day))
+        except ValueError:
+            continue
+        path = os.path.join(directory, name)
+        yield ResultFile(departure=departure.upper(), destination=destination.upper(),
+                         date="{}/{}/{}".format(month, day, year), scraped_at=os.path.getmtime(path), path=path)
+
+
+def load_result(path):
+    """ Loading result file: returns tuple - (task, outbound flights, return flights).
+        Task is dictionary saved in round trip files ("departure", "destination", "date", "return_date", "trip_type"),
+        one way files have only a list of flights - task is None and return flights list is empty for them.
+    """
+    with open(path, 'r') as file:
+        data = json.load(file)
+    if isinstance(data, dict):
+        return (data["task"], [Flight.from_dict(dictionary) for dictionary in data.get("outbound", [])],
+                [Flight.from_dict(dictionary) for dictionary in data.get("return", [])])
+    return None, [Flight.from_dict(dictionary) for dictionary in data], []
+
+
+def load_flights(path, leg="outbound"):
+    """ Loading 'Flight' records from result file.
+        :param leg: for round trip files - "outbound" or "return" flights
+    """
+    _, outbound_flights, return_flights = load_result(path)
+    return return_flights if leg == "return" else outbound_flights
+
+
+def lowest_price(flights):
+    """ Lowest known price among :param flights: (None if no flight has a price)"""
+    prices = [flight.price for flight in flights if flight.price is not None]
+    return min(prices) if prices else None
+
+
+def price_key(task):
+    """ Key of historical price for quantized :param task: - (departure, destination, return date, trip type).
+        One way and round trip fares (and round trips with different return dates) are never compared.
+    """
+    return task[0], task[1], task[3], task[4]
+
+
+def historical_lowest_prices(directory):
+    """ Returns dictionary {price key: lowest price ever seen} from result files in :param directory:
+        (check 'price_key' - return date and trip type are taken from "task" record of round trip files)
+    """
+    prices = {}
+    for result_file in iter_result_files(directory):
+        try:
+            task, outbound_flights, _ = load_result(result_file.path)
+            price = lowest_price(outbound_flights)
+            if task is None:
+                key = price_key([result_file.departure, result_file.destination, result_file.date, None, "one way"])
+            else:
+                key = price_key([result_file.departure, result_file.destination, result_file.date,
+                                 task["return_date"], task["trip_type"]])
+        except (ValueError, KeyError, TypeError):
+            continue  # broken or foreign .json file
+        if price is not None and (key not in prices or price < prices[key]):
+            prices[key] = price
+    return prices
@@ -0,0 +1,163 @@
+"""
+Opt-in profiling of scraper runs (used by 'aa_manager.py --profile cpu|mem|time').
+
+Every search task is profiled inside the process, which executes it (so it works for parallel execution too),
+and results of all tasks are merged into a single report by 'ProfileReport':
+    - 'time' - wall and CPU time of every AmericanAirlines method call (cheap, fine to leave on in staging).
+               Big difference between wall and CPU time means we was waiting for the browser/site,
+               small difference - time was spent in Python (parsing, regex, JSON encoding)
+    - 'cpu'  - 'time' + cProfile statistics (top functions)
+    - 'mem'  - 'time' + tracemalloc statistics (top allocation sites and memory peak)
+Method times are inclusive: time of 'run' contains time of all methods called from it.
+"""
+import io
+import time
+import tracemalloc
+import contextlib
+
+PROFILE_MODES = ("time", "cpu", "mem")
+TOP_ENTRIES = 20  # number of functions/allocation sites in the report
+TASK_ALLOCATION_SITES = 100  # number of allocation sites each task sends to the report
+
+
+class MethodTimer:
+    """ Collecting wall and CPU time of methods calls: {method_name: [calls, wall_time, cpu_time]}"""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            entry = self.timings.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += time.perf_counter() - wall_start
+            entry[2] += time.process_time() - cpu_start
+
+    def _wrap(self, name, method):
+        def timed(*args, **kwargs):
+            with self.measure(name):
+                return method(*args, **kwargs)
+        return timed
+
+    def instrument(self, obj):
+        """ Replacing methods of :param obj: (only this instance, not the class) with timed versions"""
+        for name, attribute in vars(type(obj)).items():
+            if name.startswith('__'):
+                continue
+            if isinstance(attribute, (staticmethod, classmethod)) or callable(attribute):
+                setattr(obj, name, self._wrap(name, getattr(obj, name)))
+        return obj
+
+
+class _LoadedStats:
+    """ pstats.Stats can be created from any object with 'create_stats()' method and 'stats' attribute"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def profile_task(create, mode, label=""):
+    """ Creating object with :param create: callable and executing its 'run()' method under profiler.
+        :param create: callable, which returns object to run (AmericanAirlines instance)
+        :param mode: one of PROFILE_MODES
+        :param label: task description for the report
+        :return: dictionary with profiling results (can be sent between processes and merged by 'ProfileReport')
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError("Unknown profile mode: '{}'".format(mode))
+    timer = MethodTimer()
+    result = {"label": label, "mode": mode, "methods": timer.timings}
+    profiler = None
+    if mode == "cpu":
+        # cProfile and pstats are imported only when needed - it keeps 'aa_manager.py' startup fast
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif mode == "mem":
+        tracemalloc.start()
+    try:
+        with timer.measure('__init__'):
+            obj = create()
+        timer.instrument(obj)
+        obj.run()
+        if mode == "mem":
+            # snapshot is taken while object is still alive, so its memory is still in the statistics
+            snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                                                  tracemalloc.Filter(False, __file__),
+                                                                  tracemalloc.Filter(False, "<frozen importlib*")))
+            result["mem_peak"] = tracemalloc.get_traced_memory()[1]
+            result["mem"] = [(stat.traceback[0].filename, stat.traceback[0].lineno, stat.size, stat.count)
+                             for stat in snapshot.statistics('lineno')[:TASK_ALLOCATION_SITES]]
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.create_stats()
+            result["cpu"] = profiler.stats
+        elif mode == "mem":
+            tracemalloc.stop()
+    return result
+
+
+class ProfileReport:
+    """ Merging profiling results of separate tasks(returned by 'profile_task') into single report"""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.tasks = 0
+        self.methods = {}
+        self.cpu_stats = None
+        self.allocations = {}  # (filename, lineno) -> [size, count]
+        self.mem_peaks = []
+
+    def add(self, result):
+        self.tasks += 1
+        for name, (calls, wall_time, cpu_time) in result["methods"].items():
+            entry = self.methods.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += calls
+            entry[1] += wall_time
+            entry[2] += cpu_time
+        if "cpu" in result:
+            import pstats
+            stats = _LoadedStats(result["cpu"])
+            if self.cpu_stats is None:
+                self.cpu_stats = pstats.Stats(stats, stream=io.StringIO())
+            else:
+                self.cpu_stats.add(stats)
+        if "mem" in result:
+            self.mem_peaks.append(result["mem_peak"])
+            for filename, lineno, size, count in result["mem"]:
+                entry = self.allocations.setdefault((filename, lineno), [0, 0])
+                entry[0] += size
+                entry[1] += count
+
+    def format(self, top=TOP_ENTRIES):
+        """ Returns report as a string"""
+        lines = ["Profile report ({} mode, {} tasks)".format(self.mode, self.tasks),
+                 "",
+                 "{:<28}{:>8}{:>12}{:>12}{:>12}".format("method", "calls", "wall, s", "cpu, s", "wait, s")]
+        for name, (calls, wall_time, cpu_time) in sorted(self.methods.items(), key=lambda item: -item[1][1]):
+            lines.append("{:<28}{:>8}{:>12.3f}{:>12.3f}{:>12.3f}".format(name, calls, wall_time, cpu_time,
+                                                                       wall_time - cpu_time))
+        if self.cpu_stats is not None:
+            stream = io.StringIO()
+            self.cpu_stats.stream = stream
+            self.cpu_stats.sort_stats("cumulative").print_stats(top)
+            lines += ["", "Top functions (cumulative time):", stream.getvalue().strip()]
+        if self.mem_peaks:
+            lines += ["",
+                      "Memory peak per task: max {:.1f} KiB, average {:.1f} KiB".format(
+                          max(self.mem_peaks) / 1024, sum(self.mem_peaks) / len(self.mem_peaks) / 1024),
+                      "Top allocation sites (summed over tasks):",
+                      "{:>12}{:>10}  {}".format("size, KiB", "blocks", "site")]
+            sites = sorted(self.allocations.items(), key=lambda item: -item[1][0])[:top]
+            for (filename, lineno), (size, count) in sites:
+                lines.append("{:>12.1f}{:>10}  {}:{}".format(size / 1024, count, filename, lineno))
+        return "\n".join(lines)
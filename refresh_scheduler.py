@@ -0,0 +1,197 @@
+"""
+Volatility-aware refresh scheduling: scrape budget goes to routes, where prices really move.
+
+For every route/date (quantized task: departure, destination, departure date, return date, trip type - so one way and
+round trip searches of the same route are different routes) we look at results of previous runs
+(check 'price_history.py') and count, how often its fares changed between consecutive scrapes. Refresh interval
+of the route is expected time between changes (smoothed, so route with a few observations is not trusted too much),
+routes with departure date close to today are refreshed more often, and if all routes together need more scrapes
+than global budget (scrapes per hour) - all frequencies are scaled down to fit it.
+
+'simulate()' replays history: intervals are learned on the first part of it and checked on the rest - how many
+fare changes adaptive schedule catches(recall) and how many scrapes it needs, compared with fixed interval schedule,
+which catches the same part of changes.
+"""
+import math
+import datetime
+from collections import namedtuple, defaultdict
+
+from price_history import iter_result_files, load_result
+
+HOUR = 3600.0  # scrape times are unix timestamps(seconds), intervals - hours
+MIN_INTERVAL = 0.25  # hours, no route refreshed more often
+MAX_INTERVAL = 24.0 * 7  # hours, every route refreshed at least once a week
+PRIOR_HOURS = 24.0  # route without history expected to change once per PRIOR_HOURS
+BOOST_DAYS = 14  # routes departing in less than BOOST_DAYS days are refreshed more often
+MAX_BOOST = 3.0  # refresh frequency multiplier for route departing today
+FIXED_INTERVALS_TO_TRY = 200  # number of fixed intervals checked by 'simulate'
+
+RouteHistory = namedtuple('RouteHistory', ['snapshots', 'changes', 'first_scraped', 'last_scraped'])
+
+
+def fingerprint(flights):
+    """ Fares of single scrape: flights are 'the same', if departure times and prices are the same"""
+    return hash(tuple(sorted((str(flight.depart), str(flight.price)) for flight in flights)))
+
+
+def observations_from_history(directory):
+    """ Generator of (route key, scrape time, fares fingerprint) from result files in :param directory:.
+        Route key - quantized task as tuple: (departure, destination, departure date, return date, trip type).
+        Return date and trip type are taken from "task" record of round trip files (one way files don't have it).
+        Fingerprint of round trip covers fares of both legs.
+    """
+    for result_file in iter_result_files(directory):
+        try:
+            task, outbound_flights, return_flights = load_result(result_file.path)
+            return_date = None if task is None else task["return_date"]
+            trip_type = "one way" if task is None else task["trip_type"]
+        except (ValueError, KeyError, TypeError):
+            continue  # broken or foreign .json file
+        key = (result_file.departure, result_file.destination, result_file.date, return_date, trip_type)
+        fares = fingerprint(outbound_flights)
+        if task is not None:
+            fares = hash((fares, fingerprint(return_flights)))
+        yield key, result_file.scraped_at, fares
+
+
+def build_histories(observations, until=None):
+    """ Grouping observations by route: {route key: RouteHistory}. 'changes' - times, when fares changed.
+        :param until: ignore observations made at this time or later
+    """
+    groups = defaultdict(list)
+    for key, scraped_at, fares in observations:
+        if until is None or scraped_at < until:
+            groups[key].append((scraped_at, fares))
+    histories = {}
+    for key, snapshots in groups.items():
+        snapshots.sort()
+        changes = [current[0] for previous, current in zip(snapshots, snapshots[1:]) if previous[1] != current[1]]
+        histories[key] = RouteHistory(len(snapshots), changes, snapshots[0][0], snapshots[-1][0])
+    return histories
+
+
+def change_rate(history):
+    """ Expected number of fares changes per hour (smoothed with one change per PRIOR_HOURS)"""
+    if history is None:
+        return 1 / PRIOR_HOURS
+    span = (history.last_scraped - history.first_scraped) / HOUR
+    return (len(history.changes) + 1) / (span + PRIOR_HOURS)
+
+
+def departure_boost(date_string, now):
+    """ Refresh frequency multiplier for route with :param date_string: (mm/dd/yyyy) departure date.
+        Returns None for routes, which already departed.
+    """
+    departure_date = datetime.datetime.strptime(date_string, "%m/%d/%Y").date()
+    days_left = (departure_date - datetime.date.fromtimestamp(now)).days
+    if days_left < 0:
+        return None
+    return 1 + (MAX_BOOST - 1) * max(0, BOOST_DAYS - days_left) / BOOST_DAYS
+
+
+def refresh_intervals(histories, budget, now, keys=None):
+    """
+        Calculating refresh interval for every route.
+        :param histories: {route key: RouteHistory} ('build_histories' result)
+        :param budget: maximum number of scrapes per hour for all routes together
+        :param now: current unix time
+        :param keys: routes to schedule (default - all routes from :param histories:)
+        :return: {route key: interval in hours} (routes, which already departed, are not scheduled)
+    """
+    if budget <= 0:
+        raise ValueError("Scrape budget must be positive number")
+    frequencies = {}
+    for key in (histories if keys is None else keys):
+        boost = departure_boost(key[2], now)
+        if boost is None:
+            continue
+        frequency = change_rate(histories.get(key)) * boost
+        frequencies[key] = min(max(frequency, 1 / MAX_INTERVAL), 1 / MIN_INTERVAL)
+    total = sum(frequencies.values())
+    scale = budget / total if total > budget else 1
+    return {key: 1 / (frequency * scale) for key, frequency in frequencies.items()}
+
+
+def due_routes(histories, intervals, now):
+    """ Returns list of (overdue hours, route key) for routes, which should be scraped now - most overdue first"""
+    due = []
+    for key, interval in intervals.items():
+        overdue = (now - histories[key].last_scraped) / HOUR - interval
+        if overdue >= 0:
+            due.append((overdue, key))
+    due.sort(reverse=True)
+    return due
+
+
+def _evaluate(windows, intervals, start, end):
+    """ Replaying schedule: every route scraped at start, start + interval, ... until the end of replay.
+        :param windows: {route key: list of (change time, time of next change or end of replay)}
+        :param intervals: {route key: interval in seconds}
+        :return: tuple - (number of detected changes, number of scrapes)
+    """
+    detected = 0
+    scrapes = 0
+    for key, interval in intervals.items():
+        for change, next_change in windows.get(key, ()):
+            # first scrape at or after the change must happen before fares change again
+            first_scrape = start + math.ceil((change - start) / interval) * interval
+            if first_scrape < next_change:
+                detected += 1
+        scrapes += int((end - start) // interval) + 1
+    return detected, scrapes
+
+
+def simulate(observations, budget, train_fraction=0.5):
+    """
+        Replaying history: intervals learned on first :param train_fraction: of history time range, and then
+        adaptive and fixed interval schedules are compared on the rest of it.
+        :param observations: (route key, scrape time, fares fingerprint) - 'observations_from_history' result
+        :param budget: maximum number of scrapes per hour for adaptive schedule
+        :return: dictionary with number of changes, recall and number of scrapes for both schedules,
+                 fixed interval(hours), which gives the same recall, and saved part of scrape budget
+    """
+    if budget <= 0:
+        raise ValueError("Scrape budget must be positive number")
+    observations = list(observations)
+    if not observations:
+        raise ValueError("No history to replay")
+    times = [scraped_at for _, scraped_at, _ in observations]
+    start = min(times) + (max(times) - min(times)) * train_fraction
+    end = max(times)
+    histories = build_histories(observations)
+    # changes, which happened after training part - and for how long they stayed (until next change)
+    windows = {}
+    for key, history in histories.items():
+        changes = [change for change in history.changes if change >= start]
+        route_windows = [(change, next_change) for change, next_change in zip(changes, changes[1:] + [end])
+                         if next_change > change]
+        if route_windows:
+            windows[key] = route_windows
+    total = sum(len(route_windows) for route_windows in windows.values())
+    if not total:
+        raise ValueError("No fares changes to replay - history is too short")
+
+    # routes, which were observed after the training part, are scheduled using only training history
+    scheduled = {key for key, history in histories.items() if history.last_scraped >= start}
+    intervals = refresh_intervals(build_histories(observations, until=start), budget, start, scheduled)
+    adaptive_detected, adaptive_scrapes = _evaluate(windows, {key: interval * HOUR
+                                                              for key, interval in intervals.items()}, start, end)
+
+    # looking for the cheapest fixed interval, which catches at least the same number of changes
+    fixed = None
+    longest = max(end - start, MIN_INTERVAL * HOUR)
+    for step in range(FIXED_INTERVALS_TO_TRY):
+        interval = MIN_INTERVAL * HOUR * (longest / (MIN_INTERVAL * HOUR)) ** (step / (FIXED_INTERVALS_TO_TRY - 1))
+        detected, scrapes = _evaluate(windows, dict.fromkeys(scheduled, interval), start, end)
+        if detected >= adaptive_detected and (fixed is None or scrapes < fixed[2]):
+            fixed = (interval, detected, scrapes)
+    if fixed is None:  # even the shortest interval can't catch that many changes
+        interval = MIN_INTERVAL * HOUR
+        fixed = (interval,) + _evaluate(windows, dict.fromkeys(scheduled, interval), start, end)
+    return {"changes": total,
+            "adaptive_recall": adaptive_detected / total,
+            "adaptive_scrapes": adaptive_scrapes,
+            "fixed_interval": fixed[0] / HOUR,
+            "fixed_recall": fixed[1] / total,
+            "fixed_scrapes": fixed[2],
+            "saved": 1 - adaptive_scrapes / fixed[2] if fixed[2] else 0.0}
@@ -0,0 +1,181 @@
+"""
+Content-addressed archive of raw 'search results' pages - so pages can be parsed again (new fields, changed markup)
+without scraping them again.
+
+Every page is stored compressed (zstd if 'zstandard' package installed, otherwise gzip) under the SHA-256 hash
+of its content, so identical pages are stored only once. Index (SQLite) tells which task and leg every page
+belongs to and when it was scraped:
+    <root>/objects/ab/abcdef...html.zst   (or .html.gz)
+    <root>/index.sqlite                   - table 'pages': digest, departure, destination, date, return_date,
+                                            trip_type, leg, scraped_at
+Usage example:
+    archive = ResultsArchive('archive')
+    digest = archive.put(driver.page_source, ['LAX', 'SFO', '03/21/2018', None, 'one way'])
+    html = archive.get(digest)
+"""
+import os
+import gzip
+import time
+import sqlite3
+import hashlib
+import tempfile
+import contextlib
+from multiprocessing import Pool
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from flights import iter_flights, dump_json
+
+INDEX_FILE = "index.sqlite"
+OBJECTS_DIR = "objects"
+EXTENSIONS = {"zstd": ".html.zst", "gzip": ".html.gz"}
+
+
+class ResultsArchive:
+
+    def __init__(self, root, compression=None):
+        """
+        :param root: archive directory (created if doesn't exist)
+        :param compression: "zstd" or "gzip" (default - zstd, if 'zstandard' package is installed)
+        """
+        if compression is None:
+            compression = "gzip" if zstandard is None else "zstd"
+        if compression not in EXTENSIONS:
+            raise ValueError("Unsupported compression: '{}'".format(compression))
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstd compression needs 'zstandard' package")
+        self.root = root
+        self.compression = compression
+        os.makedirs(os.path.join(root, OBJECTS_DIR), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS pages ("
+                               "digest TEXT NOT NULL, departure TEXT, destination TEXT, date TEXT, return_date TEXT, "
+                               "trip_type TEXT, leg TEXT, scraped_at REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS pages_task ON pages (departure, destination, date)")
+            connection.execute("CREATE INDEX IF NOT EXISTS pages_digest ON pages (digest)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """ Connection(committed on exit) for single operation - archive can be shared by several processes"""
+        with contextlib.closing(sqlite3.connect(os.path.join(self.root, INDEX_FILE), timeout=60)) as connection:
+            with connection:
+                yield connection
+
+    def _object_path(self, digest, compression):
+        return os.path.join(self.root, OBJECTS_DIR, digest[:2], digest + EXTENSIONS[compression])
+
+    def _find_object(self, digest):
+        """ Returns (path, compression) of stored page or (None, None)"""
+        for compression in EXTENSIONS:
+            path = self._object_path(digest, compression)
+            if os.path.exists(path):
+                return path, compression
+        return None, None
+
+    def put(self, page_source, task, leg="outbound", scraped_at=None):
+        """ Storing page (if we don't have it yet) and adding it to the index.
+            :param page_source: html of 'search results' page
+            :param task: quantized task - [departure, destination, date, return_date, trip_type]
+            :param leg: "outbound" or "return" (second page of round trip)
+            :param scraped_at: unix time of scraping (default - now)
+            :return: content hash of the page
+        """
+        data = page_source.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        if self._find_object(digest)[0] is None:
+            path = self._object_path(digest, self.compression)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self.compression == "zstd":
+                data = zstandard.ZstdCompressor().compress(data)
+            else:
+                data = gzip.compress(data)
+            # writing to temporary file first - so other processes never see half-written page
+            handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(handle, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        with self._connect() as connection:
+            connection.execute("INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (digest, task[0], task[1], task[2], task[3], task[4], leg,
+                                time.time() if scraped_at is None else scraped_at))
+        return digest
+
+    def get(self, digest):
+        """ Returns html of the page with :param digest: content hash"""
+        path, compression = self._find_object(digest)
+        if path is None:
+            raise KeyError(digest)
+        with open(path, 'rb') as file:
+            data = file.read()
+        if compression == "zstd":
+            if zstandard is None:
+                raise ValueError("Page is compressed with zstd - install 'zstandard' package")
+            data = zstandard.ZstdDecompressor().decompress(data)
+        else:
+            data = gzip.decompress(data)
+        return data.decode("utf-8")
+
+    def entries(self, departure=None, destination=None, date=None):
+        """ Generator of index entries (dictionaries), optionally filtered by task fields, ordered by scrape time"""
+        conditions = []
+        parameters = []
+        for column, value in (("departure", departure), ("destination", destination), ("date", date)):
+            if value is not None:
+                conditions.append("{} = ?".format(column))
+                parameters.append(value)
+        query = "SELECT * FROM pages"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        with self._connect() as connection:
+            connection.row_factory = sqlite3.Row
+            for row in connection.execute(query + " ORDER BY scraped_at", parameters):
+                yield dict(row)
+
+    def digests(self):
+        """ Generator of content hashes of all stored pages (each page only once)"""
+        with self._connect() as connection:
+            for row in connection.execute("SELECT DISTINCT digest FROM pages"):
+                yield row[0]
+
+
+_worker_archive = None  # archive opened once in every 'reparse_archive' worker process
+
+
+def _open_worker_archive(root):
+    global _worker_archive
+    _worker_archive = ResultsArchive(root)
+
+
+def _reparse_page(arguments):
+    """ Parsing single archived page and saving flights to <output_dir>/<digest>.json (runs in worker process)"""
+    digest, output_dir = arguments
+    records = list(iter_flights(_worker_archive.get(digest)))
+    with open(os.path.join(output_dir, digest + ".json"), 'w') as file:
+        dump_json(records, file)
+    return digest, len(records)
+
+
+def reparse_archive(root, output_dir, processes=None):
+    """ Running 'parse_page' logic over every archived page, in parallel on all cores.
+        Flights of every page saved to <output_dir>/<digest>.json - use archive index to match them with tasks.
+        :param root: archive directory
+        :param output_dir: where to save parsed flights
+        :param processes: number of processes (default - number of cores)
+        :return: tuple - (number of pages, number of flights)
+    """
+    # opening archive creates it - wrong path must not silently turn into an empty archive
+    if not os.path.isfile(os.path.join(root, INDEX_FILE)):
+        raise ValueError("'{}' is not a results archive (no {} there)".format(root, INDEX_FILE))
+    archive = ResultsArchive(root)
+    os.makedirs(output_dir, exist_ok=True)
+    pages = 0
+    flights = 0
+    arguments = ((digest, output_dir) for digest in archive.digests())
+    with Pool(processes=processes or os.cpu_count(), initializer=_open_worker_archive, initargs=(root,)) as pool:
+        for _, count in pool.imap_unordered(_reparse_page, arguments, chunksize=16):
+            pages += 1
+            flights += count
+    return pages, flights
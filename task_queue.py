@@ -0,0 +1,162 @@
+"""
+Shared queue of quantized search tasks for running 'aa_manager.py' workers on several machines.
+
+Workers take tasks with lease semantics: leased task belongs to the worker only for 'lease_time' seconds, and
+worker must call 'heartbeat()' while task is running to extend the lease. If worker (or whole node) dies -
+lease expires and task goes back to the queue, so other worker will pick it up. Task, which lease expired
+'max_attempts' times (or which failed that many times), is marked as 'failed'.
+
+Queue interface (any shared storage - database, Redis etc. - can implement it):
+    enqueue(tasks)                      - add quantized tasks, returns number of added tasks
+    lease(worker)                       - take next task: (task_id, task) or None if nothing available
+    heartbeat(task_id, worker)          - extend the lease, returns False if task doesn't belong to worker anymore
+    complete(task_id, worker, result)   - mark task as done and store its result (False if lease was lost)
+    fail(task_id, worker, error)        - return task to the queue(or mark as failed), False if lease was lost
+    requeue_expired()                   - return tasks with expired leases to the queue
+    progress()                          - dictionary: {status: number of tasks}
+'SQLiteTaskQueue' keeps everything in a single SQLite file - it's fine for local runs and tests. Several hosts
+can share it over network file system only if file locking works there reliably.
+"""
+import json
+import time
+import sqlite3
+import contextlib
+
+LEASE_TIME = 300  # seconds, for how long worker owns leased task without heartbeat
+MAX_ATTEMPTS = 3  # how many times task can be leased before it marked as 'failed'
+ENQUEUE_BATCH = 1000  # tasks inserted in one transaction
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+STATUSES = (PENDING, LEASED, DONE, FAILED)
+
+
+class SQLiteTaskQueue:
+
+    def __init__(self, path, lease_time=LEASE_TIME, max_attempts=MAX_ATTEMPTS):
+        """
+        :param path: path to SQLite database file(created if doesn't exist)
+        :param lease_time: seconds, for how long worker owns leased task without heartbeat
+        :param max_attempts: how many times task can be leased before it marked as 'failed'
+        """
+        self.path = path
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        with self._transaction() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS tasks ("
+                               "id INTEGER PRIMARY KEY, task TEXT NOT NULL, status TEXT NOT NULL, "
+                               "worker TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, "
+                               "result TEXT, error TEXT)")
+            connection.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, id)")
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """ New connection for every operation - so queue can be used from heartbeat threads and other processes.
+            'BEGIN IMMEDIATE' takes write lock right away, so two workers can't lease the same task.
+        """
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+    def enqueue(self, tasks):
+        """ Adding quantized tasks(list or generator) to the queue. Returns number of added tasks"""
+        count = 0
+        batch = []
+        for task in tasks:
+            batch.append((json.dumps(task), PENDING))
+            if len(batch) >= ENQUEUE_BATCH:
+                count += self._insert(batch)
+                batch = []
+        if batch:
+            count += self._insert(batch)
+        return count
+
+    def _insert(self, batch):
+        with self._transaction() as connection:
+            connection.executemany("INSERT INTO tasks (task, status) VALUES (?, ?)", batch)
+        return len(batch)
+
+    @staticmethod
+    def _requeue_expired(connection, now, max_attempts):
+        # tasks of dead workers, which already used all attempts, are failed - others go back to the queue
+        connection.execute("UPDATE tasks SET status = ?, error = 'lease expired', lease_expires = NULL "
+                           "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                           (FAILED, LEASED, now, max_attempts))
+        cursor = connection.execute("UPDATE tasks SET status = ?, lease_expires = NULL "
+                                    "WHERE status = ? AND lease_expires < ?", (PENDING, LEASED, now))
+        return cursor.rowcount
+
+    def requeue_expired(self):
+        """ Returning tasks with expired leases(dead workers) to the queue. Returns number of returned tasks"""
+        with self._transaction() as connection:
+            return self._requeue_expired(connection, time.time(), self.max_attempts)
+
+    def lease(self, worker):
+        """ Taking next pending task (expired leases returned to the queue first). Returns (task_id, task) or None"""
+        now = time.time()
+        with self._transaction() as connection:
+            self._requeue_expired(connection, now, self.max_attempts)
+            row = connection.execute("SELECT id, task FROM tasks WHERE status = ? ORDER BY id LIMIT 1",
+                                     (PENDING,)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE tasks SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                               "WHERE id = ?", (LEASED, worker, now + self.lease_time, row[0]))
+        return row[0], json.loads(row[1])
+
+    def heartbeat(self, task_id, worker):
+        """ Extending the lease. Returns False, if task doesn't belong to :param worker: anymore"""
+        with self._transaction() as connection:
+            cursor = connection.execute("UPDATE tasks SET lease_expires = ? WHERE id = ? AND status = ? AND worker = ?",
+                                        (time.time() + self.lease_time, task_id, LEASED, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, task_id, worker, result):
+        """ Marking task as done and storing its result(anything JSON serializable).
+            Returns False, if task doesn't belong to :param worker: anymore (its lease expired) - nothing changed then
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute("UPDATE tasks SET status = ?, result = ?, lease_expires = NULL "
+                                        "WHERE id = ? AND status = ? AND worker = ?",
+                                        (DONE, json.dumps(result), task_id, LEASED, worker))
+        return cursor.rowcount == 1
+
+    def fail(self, task_id, worker, error):
+        """ Returning failed task to the queue, or marking it as 'failed' if it used all attempts.
+            Returns False, if task doesn't belong to :param worker: anymore (its lease expired) - nothing changed then
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                                        "error = ?, lease_expires = NULL WHERE id = ? AND status = ? AND worker = ?",
+                                        (self.max_attempts, FAILED, PENDING, error, task_id, LEASED, worker))
+        return cursor.rowcount == 1
+
+    def progress(self):
+        """ Returns dictionary: {status: number of tasks}"""
+        counts = dict.fromkeys(STATUSES, 0)
+        with contextlib.closing(sqlite3.connect(self.path, timeout=60)) as connection:
+            for status, count in connection.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status"):
+                counts[status] = count
+        return counts
+
+    def is_finished(self):
+        """ True, when there are no pending or leased tasks left"""
+        counts = self.progress()
+        return counts[PENDING] == 0 and counts[LEASED] == 0
+
+    def results(self):
+        """ Generator of (task, result) pairs for all done tasks"""
+        with contextlib.closing(sqlite3.connect(self.path, timeout=60)) as connection:
+            for task, result in connection.execute("SELECT task, result FROM tasks WHERE status = ? ORDER BY id",
+                                                   (DONE,)):
+                yield json.loads(task), json.loads(result)
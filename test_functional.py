@@ -3,10 +3,39 @@
     ```python -m unittest discover```
 """
 
+import io
+import os
+import sys
+import json
+import shutil
+import tempfile
 import unittest
 import datetime
+import contextlib
+import time
+import types
+import random
+import subprocess
+from decimal import Decimal
+
+try:
+    import bs4
+except ImportError:
+    bs4 = None
+try:
+    import american_airlines
+except ImportError:  # Selenium is not installed
+    american_airlines = None
 
 import aa_manager
+import flights
+import page_state
+import profiling
+import task_queue
+import results_archive
+import price_history
+import top_k
+import refresh_scheduler
 
 
 class TestManager(unittest.TestCase):
@@ -161,4 +190,587 @@ class TestManager(unittest.TestCase):
                       ["HSV", "SFO", "03/10/2118", None, 'one way'],
                       ["MOB", "SFO", "03/10/2118", None, 'one way'],
                       ["MGM", "SFO", "03/10/2118", None, 'one way']]
-        self.assertEqual(task_list5, aa_manager.check_and_quantize_tasks(task_dict5, airports))
\ No newline at end of file
+        self.assertEqual(task_list5, aa_manager.check_and_quantize_tasks(task_dict5, airports))
+
+    def _write_tasks_file(self, suffix, text):
+        handle, file_name = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w') as file:
+            file.write(text)
+        self.addCleanup(os.remove, file_name)
+        return file_name
+
+    def test_iter_search_tasks(self):
+        """ Testing lazy loading of .jsonl and .json task files with line numbers"""
+        file_name = self._write_tasks_file('.jsonl', '{"departure": "BHM", "destination": "MOB", "date": "03/10/2118"}\n'
+                                                     '\n'
+                                                     '{"departure": "bhm", \n'
+                                                     '{"departure": "MOB", "destination": "BHM", "date": "03/11/2118"}\n')
+        with self.assertLogs('aa_manager', level='WARNING') as logs:
+            tasks = list(aa_manager.iter_search_tasks(file_name))
+        self.assertEqual([1, 4], [line_number for line_number, task in tasks])
+        self.assertEqual('MOB', tasks[1][1]['departure'])
+        self.assertIn('Line 3', logs.output[0])
+
+        file_name = self._write_tasks_file('.json', '[\n{"departure": "BHM",\n "destination": "MOB"},\n'
+                                                    '{"departure": "MOB"}\n]')
+        tasks = list(aa_manager.iter_search_tasks(file_name))
+        self.assertEqual([(2, {"departure": "BHM", "destination": "MOB"}), (4, {"departure": "MOB"})], tasks)
+
+        # broken item of .json file is reported and skipped - like broken line of .jsonl file
+        file_name = self._write_tasks_file('.json', '[\n{"departure": "BHM"},\n{"departure": "bhm", \n'
+                                                    '{"departure": "MOB"}\n]\n')
+        with self.assertLogs('aa_manager', level='WARNING') as logs:
+            tasks = list(aa_manager.iter_search_tasks(file_name))
+        self.assertEqual([(2, {"departure": "BHM"}), (4, {"departure": "MOB"})], tasks)
+        self.assertIn('Line 3', logs.output[0])
+
+        # not a list, trailing data and not closed list are rejected
+        for text in ('{"tasks": [{"departure": "BHM"}]}', '[{"departure": "BHM"}]\n]', '[{"departure": "BHM"}'):
+            file_name = self._write_tasks_file('.json', text)
+            with self.assertRaises(ValueError):
+                list(aa_manager.iter_search_tasks(file_name))
+
+    def test_iter_quantized_tasks(self):
+        """ Tasks must be yielded lazily and invalid queries reported with their line numbers"""
+        airports = aa_manager.get_airports_codes('airports.json')
+        numbered_tasks = [(3, {"departure": "BHM", "destination": "MOB", "date": "03/10/2118"}),
+                          (7, {"departure": "nowhere", "destination": "MOB", "date": "03/10/2118"}),
+                          (9, {"destination": "MOB", "date": "03/10/2118"})]
+        tasks = aa_manager.iter_quantized_tasks(iter(numbered_tasks), airports)
+        self.assertEqual(["BHM", "MOB", "03/10/2118", None, 'one way'], next(tasks))
+        with self.assertLogs('aa_manager', level='WARNING') as logs:
+            self.assertEqual([], list(tasks))
+        self.assertIn('Line 7', logs.output[0])
+        self.assertIn('Line 9', logs.output[1])
+
+        with self.assertLogs('aa_manager', level='WARNING'):
+            with self.assertRaises(ValueError):
+                list(aa_manager.iter_quantized_tasks(iter(numbered_tasks[1:]), airports))
+
+    def test_lazy_imports(self):
+        """ Importing 'aa_manager' must not import Selenium and BeautifulSoup"""
+        code = "import sys, aa_manager; print([m for m in ('selenium', 'bs4') if m in sys.modules])"
+        output = subprocess.check_output([sys.executable, "-c", code], universal_newlines=True)
+        self.assertEqual("[]", output.strip())
+
+    def test_plan_execution(self):
+        """ Testing 'plan_execution' counts and runtime estimation"""
+        tasks = [["BHM", "SFO", "03/10/2118", None, 'one way'],
+                 ["BHM", "SFO", "03/11/2118", None, 'one way'],
+                 ["MOB", "SFO", "03/10/2118", "03/12/2118", 'round trip']]
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            routes, total_time = aa_manager.plan_execution(iter(tasks), 'serial')
+        self.assertEqual({("BHM", "SFO"): 2, ("MOB", "SFO"): 1}, dict(routes))
+        expected_time = 2 * aa_manager.ESTIMATED_TASK_TIME['one way'] + aa_manager.ESTIMATED_TASK_TIME['round trip']
+        self.assertEqual(expected_time, total_time)
+        self.assertIn("Total tasks: 3", output.getvalue())
+
+
+class TestFlights(unittest.TestCase):
+
+    flight_dicts = [{"depart": "03-21-2018 21:20:00",
+                     "arrive": "03-21-2018 22:54:00",
+                     "stops": "Nonstop",
+                     "price": "46.00",
+                     "details": [{"number": "AA  6039", "airplane": "E75-Embraer RJ-175"}]},
+                    {"depart": "03-21-2018 06:05:00",
+                     "arrive": "03-21-2018 14:40:00",
+                     "stops": "2 stops",
+                     "price": "N/A",
+                     "details": [{"number": "AA  1", "airplane": "321-Airbus A321"},
+                                 {"number": "AA  2", "airplane": "738-Boeing 737-800"}]}]
+
+    def test_flight_from_dict(self):
+        """ Testing typed fields of 'Flight' record from 'flights.py' """
+        flight1 = flights.Flight.from_dict(self.flight_dicts[0])
+        self.assertEqual(datetime.datetime(2018, 3, 21, 21, 20), flight1.depart)
+        self.assertEqual(0, flight1.stops)
+        self.assertEqual(Decimal("46.00"), flight1.price)
+        self.assertEqual(flights.Leg("AA  6039", "E75-Embraer RJ-175"), flight1.legs[0])
+
+        flight2 = flights.Flight.from_dict(self.flight_dicts[1])
+        self.assertEqual(2, flight2.stops)
+        self.assertIsNone(flight2.price)
+
+    def test_flight_to_dict(self):
+        """ Flight records must serialize to the same dictionaries 'parse_page' used to return"""
+        for dictionary in self.flight_dicts:
+            self.assertEqual(dictionary, flights.Flight.from_dict(dictionary).to_dict())
+
+    def test_parse_price_and_stops(self):
+        self.assertIsNone(flights.parse_price("9999999999"))
+        self.assertEqual(Decimal("1234.50"), flights.parse_price("1,234.50"))
+        self.assertEqual(1, flights.parse_stops("1 stop"))
+        self.assertEqual(0, flights.parse_stops("Nonstop"))
+
+    def test_dump_json(self):
+        """ Streaming 'dump_json' must produce exactly what json.dump(list, indent=2) produces"""
+        records = (flights.Flight.from_dict(dictionary) for dictionary in self.flight_dicts)
+        file = io.StringIO()
+        flights.dump_json(records, file)
+        self.assertEqual(json.dumps(self.flight_dicts, indent=2), file.getvalue())
+
+        file = io.StringIO()
+        flights.dump_json(iter([]), file)
+        self.assertEqual(json.dumps([], indent=2), file.getvalue())
+
+
+@unittest.skipIf(american_airlines is None, "Selenium is not installed")
+class TestRoundTripOutput(unittest.TestCase):
+
+    def test_save_round_trip(self):
+        """ Both legs of round trip must be saved to one record together with task and leg timings"""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        # 'save_round_trip' doesn't need a browser - so we creating crawler without calling __init__
+        crawler = american_airlines.AmericanAirlines.__new__(american_airlines.AmericanAirlines)
+        crawler.driver = types.SimpleNamespace(close=lambda: None)  # '__del__' closes the browser
+        crawler.departure, crawler.destination = "LAX", "SFO"
+        crawler.departure_date, crawler.return_date = "03/21/2118", "03/25/2118"
+        crawler.trip_type = "round trip"
+        crawler.file_path = temp_dir
+        crawler.leg_timings = {"outbound": 12.5, "return": 7.25}
+        outbound, returning = TestFlights.flight_dicts[:1], TestFlights.flight_dicts[1:]
+        crawler.save_round_trip("LAX_SFO2118-03-21-101010.json", outbound, returning)
+
+        with open(os.path.join(temp_dir, "LAX_SFO2118-03-21-101010.json"), 'r') as file:
+            record = json.load(file)
+        self.assertEqual({"task", "outbound", "return", "timings"}, set(record))
+        self.assertEqual({"departure": "LAX", "destination": "SFO", "date": "03/21/2118",
+                          "return_date": "03/25/2118", "trip_type": "round trip"}, record["task"])
+        self.assertEqual(outbound, record["outbound"])
+        self.assertEqual(returning, record["return"])
+        self.assertEqual({"outbound": 12.5, "return": 7.25}, record["timings"])
+        # price history reads both legs of such files
+        path = os.path.join(temp_dir, "LAX_SFO2118-03-21-101010.json")
+        self.assertEqual(Decimal("46.00"), price_history.lowest_price(price_history.load_flights(path)))
+        self.assertEqual(2, price_history.load_flights(path, "return")[0].stops)
+
+
+    class FakeDriver:
+        """ Browser, which shows given pages one by one: every 'fully_load_results' opens the next page"""
+
+        def __init__(self, pages):
+            self.pages = list(pages)
+            self.page_source = None
+
+        def next_page(self):
+            self.page_source = TestPageState._read_fixture(self.pages.pop(0))
+
+        def execute_script(self, script):
+            return page_state.probe_page_source(self.page_source)
+
+        def find_element_by_xpath(self, xpath):
+            return None
+
+        def close(self):
+            pass
+
+    def _run_round_trip(self, pages):
+        """ Running 'run()' of round trip search with browser actions replaced, returns saved record"""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        crawler = american_airlines.AmericanAirlines.__new__(american_airlines.AmericanAirlines)
+        crawler.driver = self.FakeDriver(pages)
+        crawler.departure, crawler.destination = "LAX", "SFO"
+        crawler.departure_date, crawler.return_date = "03/21/2118", "03/25/2118"
+        crawler.trip_type, crawler.file_format, crawler.file_path = "round trip", "json", temp_dir
+        crawler.leg_timings, crawler.archive = {}, None
+        for method in ("press_accept_cookies", "select_trip_type", "select_airline", "select_time_of_day",
+                       "fill_date_form", "fill_from_form", "fill_destination_form", "click_search",
+                       "click_on_round_trip"):
+            setattr(crawler, method, lambda *args: None)
+        crawler.fully_load_results = crawler.driver.next_page
+        file_name = crawler.run()
+        with open(os.path.join(temp_dir, file_name), 'r') as file:
+            return json.load(file)
+
+    @unittest.skipIf(bs4 is None, "bs4 is not installed")
+    def test_return_page_state(self):
+        """ Second page of round trip must be checked like the first one: empty is saved, bot wall fails the task"""
+        record = self._run_round_trip(['results.html', 'empty_results.html'])
+        self.assertEqual(2, len(record["outbound"]))
+        self.assertEqual([], record["return"])
+        with self.assertRaises(Exception) as context:
+            self._run_round_trip(['results.html', 'bot_wall.html'])
+        self.assertIn("Bot was detected", str(context.exception))
+        with self.assertRaises(Exception):
+            self._run_round_trip(['results.html', 'unknown.html'])
+
+class TestProfiling(unittest.TestCase):
+
+    class FakeCrawler:
+        """ Stand-in for AmericanAirlines: one method waits, other one burns CPU"""
+
+        def wait_for_page(self):
+            time.sleep(0.05)
+
+        def parse_page(self):
+            return [json.dumps({"price": str(i)}) for i in range(2000)]
+
+        @staticmethod
+        def _generate_file_name():
+            return "file.json"
+
+        def run(self):
+            self.wait_for_page()
+            self.parse_page()
+            return self._generate_file_name()
+
+    def test_method_timer(self):
+        """ Wall and CPU time must be recorded for every method call"""
+        timer = profiling.MethodTimer()
+        crawler = timer.instrument(self.FakeCrawler())
+        self.assertEqual("file.json", crawler.run())
+        self.assertEqual({'run', 'wait_for_page', 'parse_page', '_generate_file_name'}, set(timer.timings))
+        calls, wall_time, cpu_time = timer.timings['wait_for_page']
+        self.assertEqual(1, calls)
+        # we was sleeping - so wall time must be much bigger than CPU time
+        self.assertGreater(wall_time - cpu_time, 0.03)
+
+    def test_profile_report(self):
+        """ Results of separate tasks must be merged into single report"""
+        for mode in profiling.PROFILE_MODES:
+            report = profiling.ProfileReport(mode)
+            for _ in range(2):
+                report.add(profiling.profile_task(self.FakeCrawler, mode, "fake task"))
+            self.assertEqual(2, report.methods['run'][0])
+            text = report.format()
+            self.assertIn("parse_page", text)
+            if mode == "cpu":
+                self.assertIn("Top functions", text)
+            if mode == "mem":
+                self.assertIn("Top allocation sites", text)
+        with self.assertRaises(ValueError):
+            profiling.profile_task(self.FakeCrawler, "gpu")
+
+
+class TestTaskQueue(unittest.TestCase):
+
+    tasks = [["BHM", "MOB", "03/10/2118", None, 'one way'],
+             ["MOB", "BHM", "03/10/2118", "03/12/2118", 'round trip']]
+
+    def setUp(self):
+        handle, self.queue_file = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+        self.addCleanup(os.remove, self.queue_file)
+
+    def test_lease_and_complete(self):
+        queue = task_queue.SQLiteTaskQueue(self.queue_file)
+        self.assertEqual(2, queue.enqueue(iter(self.tasks)))
+        task_id1, task1 = queue.lease("worker1")
+        task_id2, task2 = queue.lease("worker2")
+        self.assertEqual(self.tasks, [task1, task2])
+        self.assertIsNone(queue.lease("worker3"))
+        self.assertTrue(queue.heartbeat(task_id1, "worker1"))
+        self.assertFalse(queue.heartbeat(task_id1, "worker2"))
+        queue.complete(task_id1, "worker1", {"file": "BHM_MOB.json"})
+        queue.fail(task_id2, "worker2", "Bot was detected!")
+        self.assertEqual({"pending": 1, "leased": 0, "done": 1, "failed": 0}, queue.progress())
+        self.assertEqual([(self.tasks[0], {"file": "BHM_MOB.json"})], list(queue.results()))
+
+    def test_expired_lease(self):
+        """ Task of dead worker must return to the queue, and fail after 'max_attempts' leases"""
+        queue = task_queue.SQLiteTaskQueue(self.queue_file, lease_time=0.01, max_attempts=2)
+        queue.enqueue(self.tasks[:1])
+        task_id, task = queue.lease("dead worker")
+        time.sleep(0.02)
+        # task is back in the queue, but not leased again yet - old owner can't finish or fail it
+        self.assertEqual(1, queue.requeue_expired())
+        self.assertFalse(queue.complete(task_id, "dead worker", "late result"))
+        self.assertFalse(queue.fail(task_id, "dead worker", "late error"))
+        self.assertEqual(1, queue.progress()["pending"])
+        self.assertEqual(task_id, queue.lease("worker")[0])
+        # and can't finish it after another worker took it
+        self.assertFalse(queue.complete(task_id, "dead worker", "late result"))
+        time.sleep(0.02)
+        self.assertEqual(0, queue.requeue_expired())
+        self.assertEqual(1, queue.progress()["failed"])
+        self.assertTrue(queue.is_finished())
+
+    def test_worker_loop(self):
+        """ Workers must execute every task once and push results back"""
+        queue = task_queue.SQLiteTaskQueue(self.queue_file, lease_time=0.03)
+
+        def execute(task):
+            time.sleep(0.05)  # longer than lease time - heartbeats must keep the lease
+            if task[4] == 'round trip':
+                raise ValueError("Return date must be filled!")
+            return task[0]
+
+        queue.enqueue(self.tasks)
+        with self.assertLogs('aa_manager', level='WARNING'):
+            executed = aa_manager.worker_loop(queue, "worker", execute, poll_interval=0.01, exit_when_done=True)
+        self.assertEqual(1 + task_queue.MAX_ATTEMPTS, executed)
+        self.assertEqual([(self.tasks[0], "BHM")], list(queue.results()))
+        self.assertEqual({"pending": 0, "leased": 0, "done": 1, "failed": 1}, queue.progress())
+
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            counts = aa_manager.coordinate(queue, [], wait=False)
+        self.assertEqual(1, counts["done"])
+        self.assertIn("Enqueued 0 tasks", output.getvalue())
+
+
+class TestPageState(unittest.TestCase):
+
+    fixtures = {page_state.RESULTS: 'results.html',
+                page_state.INPUT_ERROR: 'input_error.html',
+                page_state.BOT_WALL: 'bot_wall.html',
+                page_state.MAINTENANCE: 'maintenance.html',
+                page_state.EMPTY_RESULTS: 'empty_results.html',
+                page_state.UNKNOWN: 'unknown.html'}
+
+    @staticmethod
+    def _read_fixture(name):
+        with open(os.path.join('fixtures', 'page_states', name), 'r') as file:
+            return file.read()
+
+    def test_classify_page_state(self):
+        """ Testing 'classify_page_state' on probes, returned by PROBE_SCRIPT"""
+        probe = {"inputError": False, "robotsMeta": False, "maintenanceText": "", "flights": 12, "noFlights": False}
+        self.assertEqual(page_state.RESULTS, page_state.classify_page_state(probe))
+        self.assertEqual(page_state.EMPTY_RESULTS, page_state.classify_page_state(dict(probe, flights=0,
+                                                                                        noFlights=True)))
+        # page without flights and without 'no flights' message is not empty results
+        self.assertEqual(page_state.UNKNOWN, page_state.classify_page_state(dict(probe, flights=0)))
+        self.assertEqual(page_state.INPUT_ERROR, page_state.classify_page_state(dict(probe, inputError=True)))
+        self.assertEqual(page_state.BOT_WALL, page_state.classify_page_state(dict(probe, robotsMeta=True)))
+        maintenance = dict(probe, robotsMeta=True, maintenanceText=" We\u2019re working on our site ")
+        self.assertEqual(page_state.MAINTENANCE, page_state.classify_page_state(maintenance))
+
+    @unittest.skipIf(bs4 is None, "bs4 is not installed")
+    def test_page_state_fixtures(self):
+        """ Every fixture page must be classified as its state"""
+        self.assertEqual(set(page_state.PAGE_STATES), set(self.fixtures))
+        for state, name in self.fixtures.items():
+            probe = page_state.probe_page_source(self._read_fixture(name))
+            self.assertEqual(state, page_state.classify_page_state(probe), name)
+        # error box with unexpected classes and page with typographic apostrophe
+        page = '<html><body><div class="message-error">Please correct the errors below.</div></body></html>'
+        self.assertEqual(page_state.UNKNOWN, page_state.classify_page_state(page_state.probe_page_source(page)))
+        page = '<html><body><p>We couldn\u2019t find any flights for your search.</p></body></html>'
+        self.assertEqual(page_state.EMPTY_RESULTS, page_state.classify_page_state(page_state.probe_page_source(page)))
+
+    @unittest.skipIf(bs4 is None, "bs4 is not installed")
+    def test_iter_flights(self):
+        """ Testing 'iter_flights' from 'flights.py' on results page fixture"""
+        records = list(flights.iter_flights(self._read_fixture('results.html')))
+        self.assertEqual(TestFlights.flight_dicts[0], records[0].to_dict())
+        self.assertEqual(1, records[1].stops)
+        self.assertEqual("1 stop", records[1].stops_text)
+        self.assertIsNone(records[1].price)
+        self.assertEqual(2, len(records[1].legs))
+
+        # values we cant parse must be saved exactly as the site returned them (like old 'parse_page' did)
+        page = ('<ul><li class="flight-search-results js-moreflights" data-departuretime="3-21-2018 9:20:00" '
+                'data-arrivaltime="03-21-2018 22:54" data-tripprice="1,046.5"></li></ul>')
+        record = next(flights.iter_flights(page))
+        self.assertEqual({"depart": "3-21-2018 9:20:00", "arrive": "03-21-2018 22:54", "stops": "Nonstop",
+                          "price": "1,046.5", "details": []}, record.to_dict())
+        self.assertIsNone(record.arrive)
+        self.assertEqual(Decimal("1046.5"), record.price)
+
+
+class TestResultsArchive(unittest.TestCase):
+
+    task = ["BHM", "MOB", "03/10/2118", None, 'one way']
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_put_and_get(self):
+        """ Same page must be stored once, but indexed every time it was scraped"""
+        archive = results_archive.ResultsArchive(self.root, compression="gzip")
+        page = TestPageState._read_fixture('results.html')
+        digest1 = archive.put(page, self.task, scraped_at=100)
+        digest2 = archive.put(page, self.task, scraped_at=200)
+        digest3 = archive.put("<html></html>", ["MOB", "BHM", "03/10/2118", None, 'one way'], scraped_at=150)
+        self.assertEqual(digest1, digest2)
+        self.assertNotEqual(digest1, digest3)
+        self.assertEqual(page, archive.get(digest1))
+        self.assertEqual(2, len(os.listdir(os.path.join(self.root, results_archive.OBJECTS_DIR))))
+        entries = list(archive.entries(departure="BHM"))
+        self.assertEqual([100, 200], [entry["scraped_at"] for entry in entries])
+        self.assertEqual("outbound", entries[0]["leg"])
+        self.assertEqual({digest1, digest3}, set(archive.digests()))
+        with self.assertRaises(KeyError):
+            archive.get("0" * 64)
+        with self.assertRaises(ValueError):
+            results_archive.ResultsArchive(self.root, compression="lzma")
+
+    @unittest.skipIf(bs4 is None, "bs4 is not installed")
+    def test_reparse_archive(self):
+        """ Archived pages must be parsed again into the same flights"""
+        archive = results_archive.ResultsArchive(self.root)
+        digest = archive.put(TestPageState._read_fixture('results.html'), self.task)
+        archive.put(TestPageState._read_fixture('empty_results.html'), self.task)
+        output_dir = os.path.join(self.root, "reparsed")
+        self.assertEqual((2, 2), results_archive.reparse_archive(self.root, output_dir, processes=2))
+        with open(os.path.join(output_dir, digest + ".json"), 'r') as file:
+            self.assertEqual(TestFlights.flight_dicts[0], json.load(file)[0])
+        # wrong archive path is an error, not a new empty archive
+        missing = os.path.join(self.root, "no_such_archive")
+        with self.assertRaises(ValueError):
+            results_archive.reparse_archive(missing, output_dir)
+        self.assertFalse(os.path.exists(missing))
+
+
+# prices, which fake scraper 'finds' for every route (used by top-K tests, must be module level to be picklable)
+FAKE_PRICES = {"BHM": ["100.00", "110.00"], "MOB": ["90.00"], "HSV": ["450.00"], "DHN": ["300.00", "N/A"]}
+
+
+def fake_execute_for_flights(task):
+    if task[0] == "MGM":
+        raise Exception("Bot was detected!")
+    return [flights.Flight.from_strings("", "", "Nonstop", price, ()) for price in FAKE_PRICES[task[0]]]
+
+
+class TestTopK(unittest.TestCase):
+
+    def test_price_history(self):
+        """ Testing lowest prices from result files of previous runs"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        files = {"BHM_SFO2118-03-10-101010.json": TestFlights.flight_dicts,
+                 "BHM_SFO2118-03-11-101010.json": [dict(TestFlights.flight_dicts[0], price="40.50")],
+                 "MOB_SFO2118-03-10-101010.json": {"task": {"return_date": "03/12/2118", "trip_type": "round trip"},
+                                                   "outbound": TestFlights.flight_dicts, "return": []},
+                 "search_tasks.json": [{"departure": "BHM"}]}
+        for name, data in files.items():
+            with open(os.path.join(directory, name), 'w') as file:
+                json.dump(data, file)
+        result_files = sorted(price_history.iter_result_files(directory))
+        self.assertEqual(3, len(result_files))
+        self.assertEqual(("BHM", "SFO", "03/10/2118"), result_files[0][:3])
+        self.assertEqual({("BHM", "SFO", None, "one way"): Decimal("40.50"),
+                          ("MOB", "SFO", "03/12/2118", "round trip"): Decimal("46.00")},
+                         price_history.historical_lowest_prices(directory))
+
+    def test_top_k_search(self):
+        """ Pair, which can't beat K-th best fare by its history, must be skipped"""
+        tasks = [[code, "SFO", "03/10/2118", None, 'one way'] for code in ("DHN", "HSV", "MOB", "BHM", "MGM")]
+        history = {("BHM", "SFO", None, "one way"): Decimal("100"), ("MOB", "SFO", None, "one way"): Decimal("120"),
+                   ("HSV", "SFO", None, "one way"): Decimal("500")}
+        report = top_k.top_k_search(tasks, 2, fake_execute_for_flights, history, processes=1)
+        self.assertEqual([Decimal("90.00"), Decimal("100.00")], [price for price, task, flight in report["top"]])
+        self.assertEqual(["MOB", "BHM"], [task[0] for price, task, flight in report["top"]])
+        self.assertEqual({"scraped": 3, "skipped": 1, "failed": 1, "total": 5},
+                         {key: report[key] for key in ("scraped", "skipped", "failed", "total")})
+        self.assertEqual("90.00", top_k.to_records(report)[0]["price"])
+
+        # without history nothing can be skipped
+        report = top_k.top_k_search(tasks, 2, fake_execute_for_flights, processes=3)
+        self.assertEqual(0, report["skipped"])
+        self.assertEqual([Decimal("90.00"), Decimal("100.00")], [price for price, task, flight in report["top"]])
+
+    def test_round_trip_history_not_used_for_one_way(self):
+        """ Expensive round trip fare in history must not make one way pair skipped (when K best fares are cheaper)"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        record = {"task": {"departure": "HSV", "destination": "SFO", "date": "03/10/2118",
+                           "return_date": "03/15/2118", "trip_type": "round trip"},
+                  "outbound": [dict(TestFlights.flight_dicts[0], price="500.00")], "return": [], "timings": {}}
+        files = {"HSV_SFO2118-03-10-101010.json": record,
+                 "BHM_SFO2118-03-10-101010.json": [dict(TestFlights.flight_dicts[0], price="100.00")],
+                 "MOB_SFO2118-03-10-101010.json": [dict(TestFlights.flight_dicts[0], price="90.00")]}
+        for name, data in files.items():
+            with open(os.path.join(directory, name), 'w') as file:
+                json.dump(data, file)
+        history = price_history.historical_lowest_prices(directory)
+        tasks = [[code, "SFO", "03/10/2118", None, 'one way'] for code in ("DHN", "MOB", "BHM", "HSV")]
+        report = top_k.top_k_search(tasks, 2, fake_execute_for_flights, history, processes=1)
+        self.assertEqual(0, report["skipped"])
+        self.assertEqual(4, report["scraped"])
+        self.assertEqual([Decimal("90.00"), Decimal("100.00")], [price for price, task, flight in report["top"]])
+        # price is used only for round trips with the same return date
+        self.assertEqual(Decimal("500.00"),
+                         history[price_history.price_key(["HSV", "SFO", "03/10/2118", "03/15/2118", 'round trip'])])
+        self.assertNotIn(price_history.price_key(["HSV", "SFO", "03/10/2118", "03/16/2118", 'round trip']), history)
+
+
+class TestRefreshScheduler(unittest.TestCase):
+
+    now = datetime.datetime(2118, 1, 1).timestamp()
+    hour = refresh_scheduler.HOUR
+
+    def test_build_histories(self):
+        key = ("BHM", "MOB", "03/10/2118", None, "one way")
+        observations = [(key, 3 * self.hour, "b"), (key, 0, "a"), (key, self.hour, "a"), (key, 4 * self.hour, "a")]
+        history = refresh_scheduler.build_histories(observations)[key]
+        self.assertEqual((4, [3 * self.hour, 4 * self.hour], 0, 4 * self.hour), tuple(history))
+        history = refresh_scheduler.build_histories(observations, until=2 * self.hour)[key]
+        self.assertEqual([], history.changes)
+
+    def test_refresh_intervals(self):
+        """ Volatile and close to departure routes must be refreshed more often, all routes - within budget"""
+        volatile = ("BHM", "MOB", "03/10/2118", None, "one way")
+        stable = ("MOB", "BHM", "03/10/2118", None, "one way")
+        soon = ("HSV", "BHM", "01/02/2118", None, "one way")
+        departed = ("DHN", "BHM", "12/31/2117", None, "one way")
+        changes = [i * self.hour for i in range(48)]
+        histories = {volatile: refresh_scheduler.RouteHistory(49, changes, 0, 48 * self.hour),
+                     stable: refresh_scheduler.RouteHistory(49, [], 0, 48 * self.hour),
+                     soon: refresh_scheduler.RouteHistory(49, [], 0, 48 * self.hour),
+                     departed: refresh_scheduler.RouteHistory(49, [], 0, 48 * self.hour)}
+        intervals = refresh_scheduler.refresh_intervals(histories, 100, self.now)
+        self.assertNotIn(departed, intervals)
+        self.assertLess(intervals[volatile], intervals[soon])
+        self.assertLess(intervals[soon], intervals[stable])
+        # budget is smaller than routes need - intervals are scaled
+        intervals = refresh_scheduler.refresh_intervals(histories, 0.5, self.now)
+        self.assertAlmostEqual(0.5, sum(1 / interval for interval in intervals.values()))
+
+        due = refresh_scheduler.due_routes(histories, intervals, 48 * self.hour + 10 * self.hour)
+        self.assertEqual([volatile], [key for overdue, key in due])
+
+        for budget in (0, -1):
+            with self.assertRaises(ValueError):
+                refresh_scheduler.refresh_intervals(histories, budget, self.now)
+            with self.assertRaises(ValueError):
+                refresh_scheduler.simulate([(volatile, 0, "a")], budget)
+
+    def test_simulate(self):
+        """ On history with a few volatile routes adaptive schedule must need fewer scrapes for the same recall"""
+        generator = random.Random(1)
+        observations = []
+        for route in range(10):
+            key = ("R{:02d}".format(route), "SFO", "03/10/2118", None, "one way")
+            fares = 0
+            change_probability = 0.5 if route < 2 else 0.01
+            for step in range(10 * 48):  # every 30 minutes for 10 days
+                if generator.random() < change_probability:
+                    fares += 1
+                observations.append((key, self.now + step * self.hour / 2, fares))
+        simulation = refresh_scheduler.simulate(observations, budget=5)
+        self.assertGreaterEqual(simulation["fixed_recall"], simulation["adaptive_recall"])
+        self.assertLess(simulation["adaptive_scrapes"], simulation["fixed_scrapes"])
+        self.assertGreater(simulation["saved"], 0.3)
+
+    def test_observations_from_history(self):
+        """ One way and round trip results of the same route/date must be separate routes"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        flight = TestFlights.flight_dicts[0]
+        task = {"departure": "BHM", "destination": "SFO", "date": "03/10/2118", "return_date": "03/15/2118",
+                "trip_type": "round trip"}
+        results = {"BHM_SFO2118-03-10-101010.json": [dict(flight, price="46.00")],
+                   "BHM_SFO2118-03-10-111010.json": [dict(flight, price="47.00")],
+                   "BHM_SFO2118-03-10-101011.json": {"task": task, "outbound": [flight], "return": [flight],
+                                                     "timings": {}},
+                   "BHM_SFO2118-03-10-111011.json": {"task": task, "outbound": [flight], "return": [],
+                                                     "timings": {}},
+                   "BHM_SFO2118-13-10-101010.json": [flight]}  # impossible date - ignored
+        for number, (name, data) in enumerate(sorted(results.items())):
+            path = os.path.join(directory, name)
+            with open(path, 'w') as file:
+                json.dump(data, file)
+            os.utime(path, (self.now + number * self.hour, self.now + number * self.hour))
+        histories = refresh_scheduler.build_histories(refresh_scheduler.observations_from_history(directory))
+        one_way = ("BHM", "SFO", "03/10/2118", None, "one way")
+        round_trip = ("BHM", "SFO", "03/10/2118", "03/15/2118", "round trip")
+        self.assertEqual({one_way, round_trip}, set(histories))
+        self.assertEqual(1, len(histories[one_way].changes))
+        # outbound fares are the same, but return leg changed
+        self.assertEqual(1, len(histories[round_trip].changes))
+        self.assertEqual(2, histories[round_trip].snapshots)
\ No newline at end of file
@@ -0,0 +1,93 @@
+"""
+Top-K cheapest search for expanded(city/state) searches.
+
+Instead of scraping every airport pair and sorting results afterwards, pair tasks are executed concurrently and
+the K cheapest flights found so far are kept in a heap. Remaining pairs are ordered by their historical lowest
+price (check 'price_history.py') - probably cheap pairs go first - and pair is skipped if even its historical
+lowest price (minus 'margin', because prices can go down) can't beat K-th best fare found so far.
+Pairs without history are always scraped. One way and round trip fares have separate history. Historical price is an estimate, not a guarantee - so with small margin
+cheap fare on unusually discounted route can be missed.
+"""
+import heapq
+import queue
+import itertools
+from decimal import Decimal
+from multiprocessing import Pool
+
+from price_history import price_key
+
+MARGIN = Decimal("0.1")  # we expect prices can go down by 10% from historical lowest price
+
+
+def top_k_search(tasks_list, k, execute, historical_prices=None, processes=4, margin=MARGIN):
+    """
+        :param tasks_list: quantized tasks (airport pairs of expanded search)
+        :param k: number of cheapest flights we want
+        :param execute: function, which scrapes single task and returns list of 'flights.Flight' records
+                        (executed in worker processes, so it must be picklable)
+        :param historical_prices: dictionary {price key: lowest historical price} ('historical_lowest_prices' result,
+                                  so only fares of the same trip type and return date are used)
+        :param processes: number of tasks executed concurrently
+        :param margin: part of historical price, by which price is expected to go down
+        :return: dictionary - "top": list of (price, task, Flight) sorted by price, "scraped", "skipped", "failed"
+                 and "total" - number of tasks
+    """
+    if k < 1:
+        raise ValueError("K must be positive number")
+    historical_prices = historical_prices or {}
+    infinity = Decimal("Infinity")
+    # tasks with cheaper history go first, tasks without history - after them(but they are never skipped)
+    pending = sorted(tasks_list, key=lambda task: historical_prices.get(price_key(task), infinity))
+    report = {"top": [], "scraped": 0, "skipped": 0, "failed": 0, "total": len(pending)}
+    pending.reverse()  # so we can pop next task from the end
+    best = []  # heap of K best fares: (-price, sequence number, task, flight) - most expensive of them on top
+    sequence = itertools.count()
+    done = queue.Queue()
+
+    def can_be_skipped(task):
+        if len(best) < k or price_key(task) not in historical_prices:
+            return False
+        expected_price = historical_prices[price_key(task)] * (1 - margin)
+        return expected_price >= -best[0][0]
+
+    with Pool(processes=processes) as pool:
+        running = 0
+        while pending or running:
+            # keeping all processes busy
+            while pending and running < processes:
+                task = pending.pop()
+                if can_be_skipped(task):
+                    report["skipped"] += 1
+                    continue
+                pool.apply_async(execute, (task,),
+                                 callback=lambda result, task=task: done.put((task, result)),
+                                 error_callback=lambda error, task=task: done.put((task, error)))
+                running += 1
+            if not running:
+                break
+            task, result = done.get()
+            running -= 1
+            if isinstance(result, BaseException):
+                report["failed"] += 1
+                continue
+            report["scraped"] += 1
+            for flight in result:
+                if flight.price is None:
+                    continue
+                entry = (-flight.price, next(sequence), task, flight)
+                if len(best) < k:
+                    heapq.heappush(best, entry)
+                elif flight.price < -best[0][0]:
+                    heapq.heapreplace(best, entry)
+    report["top"] = [(-price, task, flight) for price, _, task, flight in sorted(best, reverse=True)]
+    return report
+
+
+def to_records(report):
+    """ Returns top flights from 'top_k_search' report as JSON friendly dictionaries (flight + its task)"""
+    records = []
+    for _, task, flight in report["top"]:
+        record = {"departure": task[0], "destination": task[1], "date": task[2], "return_date": task[3]}
+        record.update(flight.to_dict())
+        records.append(record)
+    return records